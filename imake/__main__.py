@@ -1,43 +1,121 @@
 import argparse
+import atexit
 import base64
+import os
 import time
 from dataclasses import asdict
-from typing import Any, Callable, Final
+from typing import Any, Callable, Final, Iterator
 
+import bottle
 import cv2
 import eel
 import numpy as np
-from PIL import Image
 
 from .dataclasses import HSV, FacePaint
 from .dataclasses.diagnosis import Choice
+from .libs.bufferpool import BufferPool
+from .libs.calibration import ProjectorCalibration, create_chessboard, find_homography
+from .libs.camera import Camera
+from .libs.crop import CropMapper, FaceCrop, crop_face
 from .libs.diagnosis import EyeDiagnosis
+from .libs.effect import Effect, WarpEngine
+from .libs.encoder import AdaptiveJpegEncoder, get_content_box
 from .libs.facemesh import FaceMesh
+from .libs.imagecache import read_image
+from .libs.inference import InferenceService
 from .libs.palette import PALETTE
+from .libs.pipeline import Pipeline
+from .libs.projector import ProjectorWindow
+from .libs.replay import ReplaySource, SessionRecorder
+from .libs.stream import FrameStream
+from .libs.tracking import LandmarkTracker
 from .mode import BaseModeEffectType, ConfigMode, CustomMode, DiagnosisMode, Mode
 
 
 class IMake:
     EEL_SLEEP_TIME: Final = 0.00000001
+    STREAM_PATH: Final = "/stream.mjpg"
 
     RENDER_IMAGE_WIDTH: Final = 960
     RENDER_IMAGE_HEIGHT: Final = 1080
 
+    CALIBRATION_ATTEMPTS: Final = 30  # チェスボードを検出できるまでカメラ画像を読む回数
+    CALIBRATION_WAIT: Final = 0.2  # パターンを表示してから、カメラに映るまで待つ時間(秒)
+
     def __init__(
         self,
         camera_id: int,
         scale: float,
         effect_width: int,
         debug: bool,
+        warp_engine: WarpEngine = WarpEngine.TRIANGLE,
+        render_workers: int | None = None,
+        cull_triangles: bool = False,
+        adaptive_lod: bool = False,
+        reuse_threshold: float | None = None,
+        rigid_reuse_threshold: float | None = None,
+        use_mipmap: bool = False,
+        max_num_faces: int = 1,
+        single_inference: bool = False,
+        refine_interval: int | None = None,
+        keyframe_interval: int | None = None,
+        use_pipeline: bool = False,
+        pipeline_queue_size: int = 2,
+        inference_workers: int | None = None,
+        camera_width: int | None = None,
+        camera_height: int | None = None,
+        camera_fps: float | None = None,
+        camera_fourcc: str | None = None,
+        camera_buffer_size: int | None = None,
+        record_path: str | None = None,
+        replay_path: str | None = None,
+        replay_max_speed: bool = False,
+        replay_landmarks: bool = False,
+        stream: bool = False,
+        jpeg_quality: int = 95,
+        encode_budget_ms: float | None = None,
+        target_bitrate: float | None = None,
+        projector: bool = False,
+        projector_position: tuple[int, int] = (0, 0),
+        projector_refresh_rate: float = 60.0,
+        crop_output: bool = False,
+        direct_render: bool = False,
+        use_buffer_pool: bool = False,
+        calibration_path: str | None = None,
     ) -> None:
-        self.face_mesh = FaceMesh(refine_landmarks=True)
+        if crop_output and stream:
+            raise ValueError("crop_output cannot be used with stream")
+        self.max_num_faces = max_num_faces
+        self.face_mesh = FaceMesh(max_num_faces=max_num_faces, refine_landmarks=True)
         self.face_mesh2 = FaceMesh(refine_landmarks=True)
+        # キーフレームの間はself.face_meshの推論の代わりにオプティカルフローで追跡する
+        self.tracker = LandmarkTracker(self.face_mesh, keyframe_interval) if keyframe_interval is not None else None
 
-        self.cap = cv2.VideoCapture(camera_id)
-        # self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        # self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        self.cap: Camera | ReplaySource
+        if replay_path is not None:
+            self.cap = ReplaySource(replay_path, realtime=not replay_max_speed, landmarks_only=replay_landmarks)
+        else:
+            self.cap = Camera(
+                camera_id,
+                width=camera_width,
+                height=camera_height,
+                fps=camera_fps,
+                fourcc=camera_fourcc,
+                buffer_size=camera_buffer_size,
+            )
+        self.replay_landmarks = replay_path is not None and replay_landmarks  # 推論せずに記録したランドマークを使う
+        # 切り取った顔画像での2回目の推論を、1回目のランドマークの座標変換で置き換える (ランドマークの再生では常に)
+        self.crop_mapper = (
+            CropMapper(None if self.replay_landmarks else refine_interval)
+            if single_inference or self.replay_landmarks
+            else None
+        )
+        self.recorder = SessionRecorder(record_path) if record_path is not None else None
+        if self.recorder is not None:
+            atexit.register(self.recorder.close)
         print(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         print(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        print(self.cap.get(cv2.CAP_PROP_FPS))
 
         self.debug = debug
 
@@ -47,11 +125,53 @@ class IMake:
         self.focusing_coefficient_left = 1.0
         self.focusing_coefficient_top = 1.0
         self.face_center = (self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) / 2, self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) / 2)
+        # カメラ画像から出力画像へのホモグラフィ. 設定されている間は、上の手動の位置合わせの代わりに使う
+        self.calibration_path = calibration_path
+        self.calibration = (
+            ProjectorCalibration.load(calibration_path, (self.RENDER_IMAGE_WIDTH, self.RENDER_IMAGE_HEIGHT))
+            if calibration_path is not None and os.path.exists(calibration_path)
+            else None
+        )
 
         self.EFFECT_WIDTH: Final = effect_width
+        # 毎フレームの大きな配列をshapeごとに使い回す (エフェクトのoverlayや出力画像)
+        self.buffer_pool = BufferPool() if use_buffer_pool else None
+        self.effect_options: dict[str, Any] = dict(
+            warp_engine=warp_engine,
+            render_workers=render_workers,
+            cull_triangles=cull_triangles,
+            adaptive_lod=adaptive_lod,
+            reuse_threshold=reuse_threshold,
+            rigid_reuse_threshold=rigid_reuse_threshold,
+            use_mipmap=use_mipmap,
+            buffer_pool=self.buffer_pool,
+        )
+        # 切り取った顔に描画してから拡大縮小・移動・反転せずに、出力画像に1回で描画する
+        self.direct_render = direct_render
 
         self.skin_hsv = PALETTE["skin"][0]
         self.back_process = None
+        self.use_pipeline = use_pipeline
+        self.pipeline_queue_size = pipeline_queue_size
+        self.pipeline: Pipeline | None = None
+        # パイプラインのinferenceステージが最後に検出した顔の中心 (カメラ画像の座標). 止まっている間はNone
+        self.pipeline_face_center: tuple[int, int] | None = None
+        self.inference_workers = inference_workers  # パイプラインでself.face_meshの代わりに使うプロセス数
+        self.inference_service: InferenceService | None = None
+        # フレームをeel(base64のdata URL)ではなく、MJPEGのHTTPストリームで送る
+        self.frame_stream = FrameStream(eel.sleep) if stream else None
+        if self.frame_stream is not None:
+            bottle.route(self.STREAM_PATH, callback=self._stream_frames)
+        # エンコード時間の予算・目標ビットレートに合わせてJPEGの品質を変える
+        self.encoder = AdaptiveJpegEncoder(
+            max_quality=jpeg_quality, budget_ms=encode_budget_ms, target_bitrate=target_bitrate
+        )
+        # フレームをフロントエンドに送らずに、ネイティブのフルスクリーンウィンドウに表示する (eelは操作画面としてだけ使う)
+        self.projector = (
+            ProjectorWindow(projector_position, refresh_rate=projector_refresh_rate) if projector else None
+        )
+        # 黒くない部分だけをエンコードして、位置と一緒にフロントエンドに送る (MJPEGのストリームでは位置を送れない)
+        self.crop_output = crop_output
 
     # Mode
     def get_mode_choices(self) -> list[dict[str, str]]:
@@ -71,7 +191,7 @@ class IMake:
         Args:
             mode_name (_type_): mode name
         """
-        self.mode: BaseModeEffectType = Mode[mode_name].value(**kwargs)  # type: ignore
+        self.mode: BaseModeEffectType = Mode[mode_name].value(**self.effect_options, **kwargs)  # type: ignore
 
     def get_choice_facepaints(self) -> list[dict]:
         """Get choice facepaints.
@@ -152,7 +272,15 @@ class IMake:
         self.focusing_coefficient_top += diff
 
     def set_face_center(self) -> None:
-        """Set face center."""
+        """Set face center.
+
+        パイプラインの実行中は、カメラとFaceMeshをinferenceステージと取り合わないように、最後に検出した顔の中心を使う.
+        """
+        pipeline_face_center = self.pipeline_face_center
+        if pipeline_face_center is not None:
+            self.face_center = pipeline_face_center
+            return
+
         try:
             image = self._get_image()
         except Exception as e:
@@ -162,30 +290,84 @@ class IMake:
             original_landmarks = self.face_mesh.get_landmarks(image)
         except Exception as e:
             raise e
+        self.face_center = self._get_face_center(original_landmarks)
+
+    @staticmethod
+    def _get_face_center(landmarks: np.ndarray) -> tuple[int, int]:
+        """Get the center of the bounding box of the landmarks.
+
+        Args:
+            landmarks (np.ndarray): landmarks of a face on the camera image
 
-        face_left = int(np.amin(original_landmarks[:, 0]))
-        face_right = int(np.amax(original_landmarks[:, 0]))
-        face_top = int(np.amin(original_landmarks[:, 1]))
-        face_bottom = int(np.amax(original_landmarks[:, 1]))
-        self.face_center = (
+        Returns:
+            tuple[int, int]: center
+        """
+        face_left = int(np.amin(landmarks[:, 0]))
+        face_right = int(np.amax(landmarks[:, 0]))
+        face_top = int(np.amin(landmarks[:, 1]))
+        face_bottom = int(np.amax(landmarks[:, 1]))
+        return (
             int((face_left + face_right) / 2),
             int((face_top + face_bottom) / 2),
         )
 
     def start_skin_color(self) -> None:
         self._kill_back_process()
-        self.mode = ConfigMode()  # FIXME ??
-        image = cv2.imread(self.mode.SKIN_IMAGE_PATH, -1)
+        self.mode = ConfigMode(**self.effect_options)  # FIXME ??
+        image = read_image(self.mode.SKIN_IMAGE_PATH)
         self.mode.set_effect_image(image)
         self.set_skin_color(asdict(self.skin_hsv))
-        self.back_process = eel.spawn(self._start_rendering)
+        self._spawn_rendering()
 
     def start_config(self) -> None:
         self._kill_back_process()
-        self.mode = ConfigMode()
-        image = cv2.imread(self.mode.ADJUSTMENT_IMAGE_PATH, -1)
+        self.mode = ConfigMode(**self.effect_options)
+        image = read_image(self.mode.ADJUSTMENT_IMAGE_PATH)
         self.mode.set_effect_image(image)
-        self.back_process = eel.spawn(self._start_rendering)
+        self._spawn_rendering()
+
+    def start_calibration(self) -> None:
+        """Project a chessboard, detect it with the camera and align the output by the homography.
+
+        成功したら、start_configと同じ調整用の画像で描画を続ける.
+        """
+        self._kill_back_process()
+        self.mode = ConfigMode(**self.effect_options)
+        image = read_image(self.mode.ADJUSTMENT_IMAGE_PATH)
+        self.mode.set_effect_image(image)
+        self._start_stream()
+        self.back_process = eel.spawn(self._start_calibration)
+
+    def clear_calibration(self) -> None:
+        """Go back to the manual alignment (scale, offsets and focusing coefficients).
+
+        保存したキャリブレーションのファイルは、次に起動したときに読み込まれないように.bakに名前を変えて残す.
+        (間違えて消しても、名前を戻せば元のキャリブレーションを使える)
+        """
+        self.calibration = None
+        if self.calibration_path is not None and os.path.exists(self.calibration_path):
+            os.replace(self.calibration_path, self.calibration_path + ".bak")
+
+    def _start_calibration(self) -> None:
+        pattern, pattern_corners = create_chessboard(self.RENDER_IMAGE_WIDTH, self.RENDER_IMAGE_HEIGHT)
+        for _ in range(self.CALIBRATION_ATTEMPTS):
+            self._output_frame(pattern.copy())
+            eel.sleep(self.CALIBRATION_WAIT)
+            homography = find_homography(self._get_image(), pattern, pattern_corners)
+            if homography is not None:
+                break
+        else:
+            print("Calibration pattern not found", time.time())
+            homography = None
+
+        if homography is not None:
+            self.calibration = ProjectorCalibration(homography, (self.RENDER_IMAGE_WIDTH, self.RENDER_IMAGE_HEIGHT))
+            if self.calibration_path is not None:
+                self.calibration.save(self.calibration_path)
+        if self.use_pipeline:
+            self._start_pipeline_rendering()
+        else:
+            self._start_rendering()
 
     def get_skin_palette(self) -> list[dict]:
         """Get color palette for skin.
@@ -207,26 +389,61 @@ class IMake:
 
     def close(self) -> None:
         self.cap.release()
+        if self.recorder is not None:
+            self.recorder.close()
         self.face_mesh.close()
+        if self.inference_service is not None:
+            self.inference_service.close()
+        if self.projector is not None:
+            self.projector.close()
 
     # Rendering
     def start_rendering(self) -> None:
         """Start rendering."""
         self._kill_back_process()
-        self.back_process = eel.spawn(self._start_rendering)
+        self._spawn_rendering()
+
+    def _spawn_rendering(self) -> None:
+        """Spawn the rendering loop as the back process."""
+        self._start_stream()
+        if self.use_pipeline:
+            self.back_process = eel.spawn(self._start_pipeline_rendering)
+        else:
+            self.back_process = eel.spawn(self._start_rendering)
 
     def _start_rendering(self) -> None:
+        self.encoder.start()
+        try:
+            self._render_loop()
+        finally:  # kill()でも止める
+            self.encoder.stop()
+
+    def _render_loop(self) -> None:
+        """推論と描画をこのgreenletで行い、エンコードはエンコーダーのスレッドに任せる."""
         while True:
             eel.sleep(self.EEL_SLEEP_TIME)
+            output = self.encoder.get()
+            if output is not None:
+                self._send_frame(*output)
             start_time = time.time()
 
             try:
-                image = self._get_image()
+                image, timestamp = self.cap.read_with_timestamp()
             except Exception as e:
                 raise e
 
             try:
-                effect = self._create_effect(image, self.mode.create_effect)  # type: ignore
+                landmarks = self._get_session_landmarks(image, timestamp)
+                if self.max_num_faces > 1:
+                    effect = self._create_multi_face_effect(
+                        image, self.mode.create_effect, landmarks=landmarks  # type: ignore
+                    )
+                else:
+                    effect = self._create_effect(
+                        image,
+                        self.mode.create_effect,  # type: ignore
+                        original_landmarks=None if landmarks is None else landmarks[0],
+                    )
             except Exception as e:
                 print(e, time.time())
                 if self.debug:
@@ -234,22 +451,309 @@ class IMake:
                 else:
                     continue
 
+            effect = self._draw_stats(effect, ["FPS: {:.2f}".format(1.0 / (time.time() - start_time))])
+            if self.projector is not None:
+                self.projector.show(effect)
+            else:
+                self.encoder.submit(*self._crop_output(effect))
+
+    def _start_pipeline_rendering(self) -> None:
+        """capture/inference/render/encodeを別々のスレッドで並列に動かし、出力だけをこのgreenletで送る.
+
+        プロジェクターに表示する場合は、encodeの代わりにprojectステージでウィンドウに渡す.
+        """
+        output_stage = (
+            ("project", self._project_stage) if self.projector is not None else ("encode", self._encode_stage)
+        )
+        self.pipeline = Pipeline(
+            [
+                ("capture", self._capture_stage),
+                ("inference", self._inference_stage),
+                ("render", self._render_stage),
+                output_stage,
+            ],
+            maxsize=self.pipeline_queue_size,
+        )
+        self.last_render_time = time.time()
+        self.pipeline.start()
+        try:
+            while True:
+                eel.sleep(self.EEL_SLEEP_TIME)
+                output = self.pipeline.get()
+                if output is not None:
+                    self._send_frame(*output)
+        finally:  # kill()でも止める
+            self.pipeline.stop()
+            if self.inference_service is not None:
+                self.inference_service.drain()  # 再開したときに、止める前のフレームの結果を返さない
+            self.pipeline_face_center = None
+
+    def get_encoder_stats(self) -> dict[str, float | int | str]:
+        """Get encode time, bytes per frame, current quality and skipped frames of the JPEG encoder.
+
+        Returns:
+            _type_: stats
+        """
+        return self.encoder.get_stats()
+
+    def get_buffer_pool_stats(self) -> dict[str, int]:
+        """Get hit and miss counts of the buffer pool.
+
+        Returns:
+            _type_: stats
+        """
+        if self.buffer_pool is None:
+            return {}
+        return self.buffer_pool.get_stats()
+
+    def get_pipeline_stats(self) -> dict[str, dict[str, int]]:
+        """Get queue depths and dropped frames of each pipeline stage.
+
+        Returns:
+            _type_: stats
+        """
+        if self.pipeline is None:
+            return {}
+        return {
+            "queue_depths": self.pipeline.get_queue_depths(),
+            "dropped_counts": self.pipeline.get_dropped_counts(),
+            "error_counts": dict(self.pipeline.error_counts),
+        }
+
+    def _capture_stage(self) -> tuple[float, np.ndarray]:
+        """Pipeline stage: capture an image with its capture time."""
+        image, timestamp = self.cap.read_with_timestamp()
+        return timestamp, image
+
+    def _inference_stage(self, frame: tuple[float, np.ndarray]) -> tuple[float, np.ndarray, Any] | None:
+        """Pipeline stage: detect faces. (debugでは顔がなくてもカメラ画像をそのまま流す)"""
+        landmarks = None
+        if self.inference_workers is not None:
+            result = self._infer_by_service(frame)
+            if result is None:
+                return None
+            frame, landmarks = result
+
+        capture_time, image = frame
+        try:
+            if self.inference_workers is None:
+                landmarks = self._get_session_landmarks(image, capture_time)
+            else:
+                if self.recorder is not None:
+                    self.recorder.record(image, capture_time, landmarks)
+                if landmarks is None:
+                    raise Exception("No face detected.")
+            detection = self._detect(image, landmarks)
+        except Exception as e:
+            if not self.debug:
+                raise e
+            print(e, time.time())
+            detection = None
+        return capture_time, image, detection
+
+    def _detect(self, image: np.ndarray, landmarks: np.ndarray | None) -> Any:
+        """Detect faces for the current rendering (calibrated, multi-face or single face).
+
+        Args:
+            image (np.ndarray): camera image
+            landmarks (np.ndarray | None): landmarks of all faces. None to run face mesh.
+
+        Returns:
+            _type_: detection passed to the render stage
+        """
+        if landmarks is None:
+            landmarks = self._infer_landmarks(image)
+        # set_face_centerのために公開する (_detect_facesがlandmarksを書き換える前に求める)
+        self.pipeline_face_center = self._get_face_center(landmarks[0])
+        if self.calibration is not None:
+            return self._detect_calibrated(image, landmarks)
+        if self.max_num_faces > 1:
+            return self._detect_faces(image, landmarks=landmarks)
+        return self._detect_face(image, landmarks[0])
+
+    def _infer_by_service(
+        self, frame: tuple[float, np.ndarray]
+    ) -> tuple[tuple[float, np.ndarray], np.ndarray | None] | None:
+        """Submit the frame to the inference processes and get the result of an older frame in order.
+
+        Args:
+            frame (tuple[float, np.ndarray]): (capture time, image)
+
+        Returns:
+            _type_: (frame, landmarks of all faces) of the oldest finished frame. None if nothing is finished.
+        """
+        assert self.inference_workers is not None
+        capture_time, image = frame
+        if self.inference_service is None:
+            self.inference_service = InferenceService(
+                self.inference_workers, image.shape, max_num_faces=self.max_num_faces  # type: ignore
+            )
+        # 遅延が大きくならないように、ワーカーの数より多くのフレームは待たせない
+        wait = self.inference_service.get_num_in_flight() >= self.inference_workers
+        result = self.inference_service.get(wait)
+        self.inference_service.submit(image, frame)
+        return result
+
+    def _render_stage(self, frame: tuple[float, np.ndarray, Any]) -> np.ndarray:
+        """Pipeline stage: render the effect and draw stats."""
+        capture_time, image, detection = frame
+        if detection is None:  # debug
+            effect = image
+        elif self.calibration is not None:
+            effect = self._render_calibrated(detection, self.mode.create_effect)  # type: ignore
+        elif self.max_num_faces > 1:
+            effect = self._render_faces(detection, self.mode.create_effect)  # type: ignore
+        else:
+            effect = self._render_face(detection, image.shape[1], self.mode.create_effect)  # type: ignore
+
+        now = time.time()
+        fps = 1.0 / max(now - self.last_render_time, 1e-6)
+        self.last_render_time = now
+        assert self.pipeline is not None
+        depths = " ".join(f"{name}={depth}" for name, depth in self.pipeline.get_queue_depths().items())
+        effect = self._draw_stats(
+            effect,
+            ["FPS: {:.2f}".format(fps), "Latency: {:.0f}ms".format((now - capture_time) * 1000), f"Queue: {depths}"],
+        )
+        return effect
+
+    def _encode_stage(self, effect: np.ndarray) -> tuple[bytes, tuple[int, int] | None] | None:
+        """Pipeline stage: encode the effect. (より新しいフレームが描画済みなら、エンコードせずに捨てる)"""
+        assert self.pipeline is not None
+        if len(self.pipeline.queues["render"]) > 0:
+            self.encoder.skipped_count += 1
+            return None
+        region, offset = self._crop_output(effect)
+        return self._encode_image(region), offset
+
+    def _project_stage(self, effect: np.ndarray) -> None:
+        """Pipeline stage: show the effect on the projector window."""
+        assert self.projector is not None
+        self.projector.show(effect)
+
+    def _draw_stats(self, effect: np.ndarray, texts: list[str]) -> np.ndarray:
+        """Draw stats on the effect.
+
+        Args:
+            effect (np.ndarray): effect(BGR)
+            texts (list[str]): lines to draw (カメラとCulledは自動で追加する)
+
+        Returns:
+            np.ndarray: effect with the stats. (Effectが使い回すoverlayそのものなら、コピーに描く)
+        """
+        if self.crop_output and not self.debug:  # 左上の文字まで切り取る範囲に入ってしまうので、debugでだけ描く
+            return effect
+        if isinstance(self.mode, Effect) and self.mode.shares_cached_overlay(effect):
+            effect = effect.copy()  # 文字が次のフレームのoverlayに焼き込まれないように
+        texts = texts + ["Camera: {:.2f}fps, dropped {}".format(self.cap.capture_fps, self.cap.dropped_count)]
+        if self.projector is not None:
+            texts = texts + [
+                "Projector: {:.2f}fps, dropped {}".format(self.projector.present_fps, self.projector.dropped_count)
+            ]
+        else:
+            texts = texts + [
+                "Encode: {:.1f}ms, {:.0f}KB, q={} {}".format(
+                    self.encoder.encode_ms,
+                    self.encoder.bytes_per_frame / 1024,
+                    self.encoder.quality,
+                    self.encoder.subsampling,
+                )
+            ]
+        if self.buffer_pool is not None:
+            stats = self.buffer_pool.get_stats()
+            texts = texts + ["Pool: hit {}, miss {}".format(stats["hit_count"], stats["miss_count"])]
+        if self.mode.cull_triangles:  # type: ignore
+            texts = texts + ["Culled: {}".format(self.mode.culled_triangles_count)]  # type: ignore
+        for i, text in enumerate(texts):
             cv2.putText(
                 effect,
-                "FPS: {:.2f}".format(1.0 / (time.time() - start_time)),
-                (10, 30),
+                text,
+                (10, 30 * (i + 1)),
                 cv2.FONT_HERSHEY_SIMPLEX,
                 1.0,
                 (0, 255, 0),
                 thickness=2,
             )
-            _, imencode_image = cv2.imencode(".jpg", effect)
-            base64_image = base64.b64encode(imencode_image)
-            eel.setVideoSrc("data:image/jpg;base64," + base64_image.decode("ascii"))
+        return effect
+
+    def _encode_image(self, effect: np.ndarray) -> bytes:
+        """Encode the effect to JPEG.
+
+        Args:
+            effect (np.ndarray): effect(BGR)
+
+        Returns:
+            bytes: JPEG
+        """
+        return self.encoder.encode(effect)
+
+    def _output_frame(self, effect: np.ndarray) -> None:
+        """Show the effect on the projector window, or encode and send it to the frontend.
+
+        Args:
+            effect (np.ndarray): effect(BGR)
+        """
+        if self.projector is not None:
+            self.projector.show(effect)
+        else:
+            region, offset = self._crop_output(effect)
+            self._send_frame(self._encode_image(region), offset)
+
+    def _crop_output(self, effect: np.ndarray) -> tuple[np.ndarray, tuple[int, int] | None]:
+        """Crop the bounding box of non-black pixels if crop_output is set.
+
+        Args:
+            effect (np.ndarray): effect(BGR)
+
+        Returns:
+            tuple[np.ndarray, tuple[int, int] | None]: (region to encode, offset (x, y) of the region)
+        """
+        if not self.crop_output:
+            return effect, None
+        box = get_content_box(effect)
+        if box is None:  # 真っ黒なフレームでも、前のフレームを消すために小さな黒い画像を送る
+            return effect[:1, :1], (0, 0)
+        x, y, width, height = box
+        return effect[y : y + height, x : x + width], (x, y)
+
+    def _send_frame(self, jpeg: bytes, offset: tuple[int, int] | None = None) -> None:
+        """Send the frame to the frontend.
+
+        Args:
+            jpeg (bytes): JPEG
+            offset (tuple[int, int] | None, optional): position (x, y) of the cropped frame. Defaults to None.
+                (If None, the frame is the whole output)
+        """
+        if self.frame_stream is not None:
+            self.frame_stream.publish(jpeg)
+            return
+        src = "data:image/jpg;base64," + base64.b64encode(jpeg).decode("ascii")
+        if offset is None:
+            eel.setVideoSrc(src)
+        else:
+            eel.setVideoCrop(src, *offset)  # フロントエンドで黒い背景の上に置く
+
+    def _start_stream(self) -> None:
+        """フロントエンドの映像をMJPEGのストリームにつなぐ. (stopでguide.pngに切り替わった後につなぎ直す)"""
+        if self.frame_stream is not None:
+            eel.setVideoSrc(f"{self.STREAM_PATH}?t={time.time()}")
+
+    def _stream_frames(self) -> Iterator[bytes]:
+        """HTTP handler of STREAM_PATH.
+
+        Returns:
+            Iterator[bytes]: multipart body
+        """
+        assert self.frame_stream is not None
+        bottle.response.content_type = FrameStream.CONTENT_TYPE
+        bottle.response.set_header("Cache-Control", "no-cache")
+        return self.frame_stream.frames()
 
     def stop(self) -> None:
         self._kill_back_process()
         eel.setVideoSrc("/dist/guide.png")  # FIXME
+        if self.projector is not None:
+            self.projector.clear()
 
     def _kill_back_process(self) -> None:
         """Kill back process."""
@@ -267,48 +771,345 @@ class IMake:
             raise Exception("Failed to get image")
         return image
 
-    def _create_effect(self, image: np.ndarray, effect_func: Callable, mirror: bool = True) -> np.ndarray:
+    def _create_effect(
+        self,
+        image: np.ndarray,
+        effect_func: Callable,
+        mirror: bool = True,
+        original_landmarks: np.ndarray | None = None,
+    ) -> np.ndarray:
         """Create effect.
 
         Returns:
             _type_: effect(BGR)
         """
-        try:
-            original_landmarks = self.face_mesh.get_landmarks(image)
-        except Exception as e:
-            raise e
+        if self.calibration is not None:
+            landmarks = None if original_landmarks is None else original_landmarks[np.newaxis]
+            return self._render_calibrated(self._detect_calibrated(image, landmarks), effect_func)
+        return self._render_face(self._detect_face(image, original_landmarks), image.shape[1], effect_func, mirror)
 
-        face_left = int(np.amin(original_landmarks[:, 0]))
-        face_right = int(np.amax(original_landmarks[:, 0]))
-        face_width = face_right - face_left
-        face_top = int(np.amin(original_landmarks[:, 1]))
-        face_bottom = int(np.amax(original_landmarks[:, 1]))
-        face = image[face_top:face_bottom, face_left:face_right]
-        face_effect_width = cv2.resize(
-            face, (self.EFFECT_WIDTH, int(self.EFFECT_WIDTH * face.shape[0] / face.shape[1]))
-        )
-        current_face_center = (
-            int((face_left + face_right) / 2),
-            int((face_top + face_bottom) / 2),
-        )
+    def _get_session_landmarks(self, image: np.ndarray, timestamp: float) -> np.ndarray | None:
+        """セッションを記録・再生している場合に、カメラ画像の全ての顔のランドマークを取得する.
+
+        Args:
+            image (np.ndarray): camera image
+            timestamp (float): time returned with the image
+
+        Returns:
+            np.ndarray | None: landmarks (faces x landmarks x 3). None if not recording nor replaying landmarks.
+                (この場合は_detect_faceなどで推論する)
+        """
+        if self.replay_landmarks:
+            assert isinstance(self.cap, ReplaySource)
+            return self.cap.get_landmarks(timestamp)
+        if self.recorder is None:
+            return None
 
         try:
-            landmarks = self.face_mesh2.get_landmarks(face_effect_width)
+            landmarks = self._infer_landmarks(image)
         except Exception as e:
+            self.recorder.record(image, timestamp, None)
             raise e
+        self.recorder.record(image, timestamp, landmarks)
+        return landmarks
+
+    def _infer_landmarks(self, image: np.ndarray) -> np.ndarray:
+        """Get landmarks of all faces on the camera image.
+
+        Returns:
+            _type_: landmarks (faces x landmarks x 3)
+        """
+        if self.max_num_faces > 1:
+            return self.face_mesh.get_multi_face_landmarks(image)
+        if self.tracker is not None:
+            return self.tracker.get_landmarks(image)[np.newaxis]
+        return self.face_mesh.get_landmarks(image)[np.newaxis]
+
+    def _detect_face(
+        self, image: np.ndarray, original_landmarks: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray, int, tuple[int, int]]:
+        """Crop the face and get landmarks on it.
+
+        Args:
+            image (np.ndarray): camera image
+            original_landmarks (np.ndarray | None, optional): landmarks on the camera image if already inferred.
+                Defaults to None.
 
+        Returns:
+            _type_: (face resized to EFFECT_WIDTH, landmarks on it, face width, face center) on the camera image
+        """
+        if original_landmarks is None:
+            try:
+                original_landmarks = self._infer_landmarks(image)[0]
+            except Exception as e:
+                raise e
+
+        crop = crop_face(image, original_landmarks, self.EFFECT_WIDTH)
+        if self.crop_mapper is None:
+            try:
+                landmarks = self.face_mesh2.get_landmarks(crop.resized)
+            except Exception as e:
+                raise e
+        else:
+            landmarks = self._map_landmarks_to_crop(original_landmarks, crop, image.shape[1])
+        return crop.resized, landmarks, crop.width, crop.center
+
+    def _render_face(
+        self,
+        detection: tuple[np.ndarray, np.ndarray, int, tuple[int, int]],
+        image_width: int,
+        effect_func: Callable,
+        mirror: bool = True,
+    ) -> np.ndarray:
+        """Render effect of the face detected by _detect_face.
+
+        Returns:
+            _type_: effect(BGR)
+        """
+        face_effect_width, landmarks, face_width, current_face_center = detection
+        if self.direct_render:
+            return self._render_face_directly(detection, image_width, effect_func, mirror)
+        output_scale = self.scale * face_width / image_width
+        self._set_effect_output_scale(output_scale)
         effect_w_alpha = effect_func(face_effect_width, landmarks)
         effect = self._convert_rgba_to_rgb(effect_w_alpha)
-        scaled = self._scale_image(
-            effect,
-            self.scale * face_width / image.shape[1],
-        )
+        scaled = self._scale_image(effect, output_scale)
         translated = self._translate_image(
             scaled,
             int((current_face_center[0] - self.face_center[0]) * self.focusing_coefficient_left + self.x_offset),
             int((current_face_center[1] - self.face_center[1]) * self.focusing_coefficient_top + self.y_offset),
         )
-        return translated if not mirror else cv2.flip(translated, 1)
+        return translated if not mirror else cv2.flip(translated, 1, dst=self._empty_buffer(translated.shape))
+
+    def _render_face_directly(
+        self,
+        detection: tuple[np.ndarray, np.ndarray, int, tuple[int, int]],
+        image_width: int,
+        effect_func: Callable,
+        mirror: bool = True,
+    ) -> np.ndarray:
+        """Render effect of the face detected by _detect_face directly into the output image.
+
+        切り取った顔の上のランドマークを出力画像の座標に変換し、エフェクト画像から出力画像に1回でワープする.
+        (_scale_image・_translate_image・cv2.flipによる再サンプリングとコピーを省く)
+
+        Returns:
+            _type_: effect(BGR)
+        """
+        face_effect_width, landmarks, face_width, current_face_center = detection
+        warp_mat = self._get_crop_output_transform(
+            (face_effect_width.shape[1], face_effect_width.shape[0]),
+            face_width,
+            image_width,
+            current_face_center,
+            mirror,
+        )
+        output_landmarks = landmarks.copy()
+        output_landmarks[:, :2] = landmarks[:, :2] @ warp_mat[:, :2].T + warp_mat[:, 2]
+
+        canvas = self._zeros_buffer((self.RENDER_IMAGE_HEIGHT, self.RENDER_IMAGE_WIDTH, 3))
+        self._set_effect_output_scale(1.0)
+        return self._premultiply_alpha(effect_func(canvas, output_landmarks))
+
+    def _set_effect_output_scale(self, output_scale: float) -> None:
+        """create_effectの結果を出力画像にするときの拡大率をmodeに設定する. (adaptive_lodで出力画像上の顔の大きさを求める)
+
+        Args:
+            output_scale (float): scale from the rendered image to the output image
+        """
+        if isinstance(self.mode, Effect):
+            self.mode.output_scale = output_scale
+
+    def _premultiply_alpha(self, effect_w_alpha: np.ndarray) -> np.ndarray:
+        """アルファを掛けてからBGRにする. (_convert_rgba_to_rgbの浮動小数点の計算より速い)
+
+        Args:
+            effect_w_alpha (np.ndarray): effect(BGRA or BGR)
+
+        Returns:
+            np.ndarray: effect(BGR)
+        """
+        if effect_w_alpha.shape[2] == 3:
+            return effect_w_alpha
+        premultiplied = cv2.cvtColor(
+            effect_w_alpha, cv2.COLOR_RGBA2mRGBA, dst=self._empty_buffer(effect_w_alpha.shape)
+        )
+        return cv2.cvtColor(premultiplied, cv2.COLOR_BGRA2BGR, dst=self._empty_buffer(effect_w_alpha.shape[:2] + (3,)))
+
+    def _detect_calibrated(
+        self, image: np.ndarray, landmarks: np.ndarray | None = None
+    ) -> tuple[np.ndarray, tuple[int, int]]:
+        """Get landmarks of the faces to render with the calibration.
+
+        Args:
+            image (np.ndarray): camera image
+            landmarks (np.ndarray | None, optional): landmarks on the camera image if already inferred.
+                Defaults to None.
+
+        Returns:
+            _type_: (landmarks on the camera image (faces x landmarks x 3), (height, width) of the camera image)
+        """
+        if landmarks is None:
+            landmarks = self._infer_landmarks(image)
+        return landmarks, (image.shape[0], image.shape[1])
+
+    def _render_calibrated(self, detection: tuple[np.ndarray, tuple[int, int]], effect_func: Callable) -> np.ndarray:
+        """Render effect of the faces detected by _detect_calibrated.
+
+        カメラ画像の座標のまま描画し、ホモグラフィから作ったremapのテーブルで出力画像に1回で変換する.
+        (切り取り・拡大縮小・移動・反転を行わない)
+
+        Returns:
+            _type_: effect(BGR)
+        """
+        assert self.calibration is not None
+        landmarks, (height, width) = detection
+        canvas = self._zeros_buffer((height, width, 3))
+        self._set_effect_output_scale(1.0)
+        effect = self._premultiply_alpha(effect_func(canvas, landmarks if self.max_num_faces > 1 else landmarks[0]))
+        # 顔のある範囲だけをremapする
+        rect = cv2.boundingRect(landmarks[:, :, :2].reshape(-1, 2).astype(np.float32))
+        return self.calibration.warp(
+            effect, dst=self._empty_buffer((self.RENDER_IMAGE_HEIGHT, self.RENDER_IMAGE_WIDTH, 3)), rect=rect
+        )
+
+    def _map_landmarks_to_crop(self, original_landmarks: np.ndarray, crop: FaceCrop, image_width: int) -> np.ndarray:
+        """Map landmarks on the camera image to the cropped face. (refine_intervalごとに2回目の推論で補正する)
+
+        Args:
+            original_landmarks (np.ndarray): landmarks on the camera image
+            crop (FaceCrop): face cropped by crop_face
+            image_width (int): width of the camera image
+
+        Returns:
+            np.ndarray: landmarks on crop.resized
+        """
+        assert self.crop_mapper is not None
+        landmarks = self.crop_mapper.map_crop(original_landmarks, crop, image_width)
+        if not self.crop_mapper.needs_refinement():
+            return landmarks
+
+        try:
+            refined_landmarks = self.face_mesh2.get_landmarks(crop.resized)
+        except Exception:
+            return landmarks  # 切り取った画像で顔を検出できなくても、変換したランドマークで描画を続ける
+        self.crop_mapper.refine(landmarks, refined_landmarks, crop.crop_size)
+        return refined_landmarks
+
+    def _create_multi_face_effect(
+        self, image: np.ndarray, effect_func: Callable, mirror: bool = True, landmarks: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Create effect of all detected faces.
+
+        _create_effectの切り取り・拡大縮小・移動・反転をランドマークの座標変換にまとめ、
+        全ての顔を出力画像に1回で描画する.
+
+        Returns:
+            _type_: effect(BGR)
+        """
+        if self.calibration is not None:
+            return self._render_calibrated(self._detect_calibrated(image, landmarks), effect_func)
+        return self._render_faces(self._detect_faces(image, mirror, landmarks), effect_func)
+
+    def _detect_faces(self, image: np.ndarray, mirror: bool = True, landmarks: np.ndarray | None = None) -> np.ndarray:
+        """Get landmarks of all detected faces on the output image.
+
+        Args:
+            image (np.ndarray): camera image
+            mirror (bool, optional): flip horizontally. Defaults to True.
+            landmarks (np.ndarray | None, optional): landmarks on the camera image if already inferred. (書き換える)
+                Defaults to None.
+
+        Returns:
+            _type_: landmarks (faces x landmarks x 3)
+        """
+        if landmarks is None:
+            try:
+                landmarks = self._infer_landmarks(image)
+            except Exception as e:
+                raise e
+
+        for face_landmarks in landmarks:
+            warp_mat = self._get_output_transform(face_landmarks, image.shape[1], mirror)
+            face_landmarks[:, :2] = face_landmarks[:, :2] @ warp_mat[:, :2].T + warp_mat[:, 2]
+        return landmarks
+
+    def _render_faces(self, landmarks: np.ndarray, effect_func: Callable) -> np.ndarray:
+        """Render effect of all faces detected by _detect_faces.
+
+        Returns:
+            _type_: effect(BGR)
+        """
+        canvas = self._zeros_buffer((self.RENDER_IMAGE_HEIGHT, self.RENDER_IMAGE_WIDTH, 3))
+        self._set_effect_output_scale(1.0)
+        effect_w_alpha = effect_func(canvas, landmarks)
+        return self._convert_rgba_to_rgb(effect_w_alpha)
+
+    def _get_output_transform(self, landmarks: np.ndarray, image_width: int, mirror: bool) -> np.ndarray:
+        """カメラ画像の座標を出力画像の座標に変換するアフィン行列を取得する (_create_effectと同じ配置になる).
+
+        Args:
+            landmarks (np.ndarray): landmarks of a face on the camera image
+            image_width (int): width of the camera image
+            mirror (bool): flip horizontally
+
+        Returns:
+            np.ndarray: affine matrix (2 x 3)
+        """
+        face_left = int(np.amin(landmarks[:, 0]))
+        face_right = int(np.amax(landmarks[:, 0]))
+        face_top = int(np.amin(landmarks[:, 1]))
+        face_bottom = int(np.amax(landmarks[:, 1]))
+        face_width = face_right - face_left
+        effect_height = int(self.EFFECT_WIDTH * (face_bottom - face_top) / face_width)
+        current_face_center = (
+            int((face_left + face_right) / 2),
+            int((face_top + face_bottom) / 2),
+        )
+
+        # 切り取り→EFFECT_WIDTHへのリサイズと、その後の出力画像への変換をつなぐ
+        resize_factor = self.EFFECT_WIDTH / face_width
+        crop_mat = np.array(
+            [[resize_factor, 0, -face_left * resize_factor], [0, resize_factor, -face_top * resize_factor]]
+        )
+        warp_mat = self._get_crop_output_transform(
+            (self.EFFECT_WIDTH, effect_height), face_width, image_width, current_face_center, mirror
+        )
+        output_mat = warp_mat[:, :2] @ crop_mat
+        output_mat[:, 2] += warp_mat[:, 2]
+        return output_mat
+
+    def _get_crop_output_transform(
+        self,
+        crop_size: tuple[int, int],
+        face_width: int,
+        image_width: int,
+        current_face_center: tuple[int, int],
+        mirror: bool,
+    ) -> np.ndarray:
+        """切り取った顔(EFFECT_WIDTHにリサイズしたもの)の座標を出力画像の座標に変換するアフィン行列を取得する.
+
+        _scale_image(中心を基準にした拡大縮小)・_translate_image・cv2.flipを1つの行列にまとめる.
+
+        Args:
+            crop_size (tuple[int, int]): (width, height) of the resized face
+            face_width (int): width of the face on the camera image
+            image_width (int): width of the camera image
+            current_face_center (tuple[int, int]): center of the face on the camera image
+            mirror (bool): flip horizontally
+
+        Returns:
+            np.ndarray: affine matrix (2 x 3)
+        """
+        scale = self.scale * face_width / image_width
+        dx = int((current_face_center[0] - self.face_center[0]) * self.focusing_coefficient_left + self.x_offset)
+        dy = int((current_face_center[1] - self.face_center[1]) * self.focusing_coefficient_top + self.y_offset)
+        tx = (1 - scale) * crop_size[0] / 2 + dx
+        ty = (1 - scale) * crop_size[1] / 2 + dy
+
+        if mirror:
+            return np.array([[-scale, 0, self.RENDER_IMAGE_WIDTH - 1 - tx], [0, scale, ty]])
+        return np.array([[scale, 0, tx], [0, scale, ty]])
 
     def _convert_rgba_to_rgb(self, image: np.ndarray) -> np.ndarray:
         """Convert RGBA image to RGB image.
@@ -370,9 +1171,40 @@ class IMake:
         Returns:
             _type_: offset image
         """
-        offset_image = Image.fromarray(np.zeros((1080, 960, 3), np.uint8))
-        offset_image.paste(Image.fromarray(image), (dx, dy))
-        return np.array(offset_image).astype(np.uint8)
+        offset_image = self._zeros_buffer((self.RENDER_IMAGE_HEIGHT, self.RENDER_IMAGE_WIDTH, 3))
+        # 出力画像からはみ出す部分を除いて貼り付ける (PIL.Image.pasteと同じ)
+        left, top = max(dx, 0), max(dy, 0)
+        right = min(dx + image.shape[1], self.RENDER_IMAGE_WIDTH)
+        bottom = min(dy + image.shape[0], self.RENDER_IMAGE_HEIGHT)
+        if left < right and top < bottom:
+            offset_image[top:bottom, left:right] = image[top - dy : bottom - dy, left - dx : right - dx]
+        return offset_image
+
+    def _zeros_buffer(self, shape: tuple[int, ...]) -> np.ndarray:
+        """Get a zero-filled uint8 image from buffer_pool if set.
+
+        Args:
+            shape (tuple[int, ...]): shape
+
+        Returns:
+            np.ndarray: image
+        """
+        if self.buffer_pool is None:
+            return np.zeros(shape, np.uint8)
+        return self.buffer_pool.zeros(shape)
+
+    def _empty_buffer(self, shape: tuple[int, ...]) -> np.ndarray | None:
+        """Get a uint8 image to pass to dst of OpenCV functions from buffer_pool if set.
+
+        Args:
+            shape (tuple[int, ...]): shape
+
+        Returns:
+            np.ndarray | None: image. None if buffer_pool is not set. (OpenCVが新しく確保する)
+        """
+        if self.buffer_pool is None:
+            return None
+        return self.buffer_pool.empty(shape)
 
     # Diagnosis
     def get_question_and_choices(self) -> tuple[str, list[str] | None]:
@@ -417,6 +1249,7 @@ class IMake:
     def start_diagnosis_func(self) -> None:
         """Start diagnosis func."""
         self._kill_back_process()
+        self._start_stream()
         self.back_process = eel.spawn(self._start_diagnosis_func)
 
     def _start_diagnosis_func(self) -> None:
@@ -453,9 +1286,7 @@ class IMake:
                 (0, 255, 0),
                 thickness=2,
             )
-            _, imencode_image = cv2.imencode(".jpg", effect)
-            base64_image = base64.b64encode(imencode_image)
-            eel.setVideoSrc("data:image/jpg;base64," + base64_image.decode("ascii"))
+            self._output_frame(effect)
 
             response = index_and_choice if isinstance(index_and_choice, str) else index_and_choice[1].text
             eel.setResponse(response)
@@ -540,6 +1371,161 @@ def main() -> None:
     parser.add_argument("--scale", type=float, default=2.0, help="scale")
     parser.add_argument("--effect_width", type=int, default=400, help="effect width")
     parser.add_argument("--debug", action="store_true", help="debug mode if this flag is set (default: False)")
+    parser.add_argument(
+        "--warp_engine",
+        type=str,
+        default=WarpEngine.TRIANGLE.name,
+        choices=[engine.name for engine in WarpEngine],
+        help="warp engine used to create the effect",
+    )
+    parser.add_argument(
+        "--cull_triangles",
+        action="store_true",
+        help="drop back-facing or degenerate triangles before warping if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--adaptive_lod",
+        action="store_true",
+        help="choose coarse/medium/full mesh from the face size on the output image every frame if this flag is set "
+        "(default: False)",
+    )
+    parser.add_argument(
+        "--reuse_threshold",
+        type=float,
+        default=None,
+        help="reuse the last overlay while landmarks move less than this (px) (default: always re-warp)",
+    )
+    parser.add_argument(
+        "--rigid_reuse_threshold",
+        type=float,
+        default=None,
+        help="move the last overlay by one affine while the motion is rigid within this error (px)",
+    )
+    parser.add_argument(
+        "--use_mipmap",
+        action="store_true",
+        help="sample the effect image from a mipmap level fitting the face size if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--max_num_faces", type=int, default=1, help="maximum number of faces to render in one pass (default: 1)"
+    )
+    parser.add_argument(
+        "--single_inference",
+        action="store_true",
+        help="map the first landmarks to the cropped face instead of a second inference if this flag is set",
+    )
+    parser.add_argument(
+        "--refine_interval",
+        type=int,
+        default=None,
+        help="run the second inference every this many frames to correct --single_inference (default: never)",
+    )
+    parser.add_argument(
+        "--keyframe_interval",
+        type=int,
+        default=None,
+        help="run face mesh at most every this many frames and track landmarks by optical flow in between",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="run capture/inference/render/encode on separate threads if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--pipeline_queue_size", type=int, default=2, help="maximum frames between pipeline stages (default: 2)"
+    )
+    parser.add_argument(
+        "--inference_workers",
+        type=int,
+        default=None,
+        help="run face mesh of --pipeline in this many processes over shared memory (default: in the pipeline thread)",
+    )
+    parser.add_argument("--camera_width", type=int, default=None, help="camera frame width (default: camera default)")
+    parser.add_argument(
+        "--camera_height", type=int, default=None, help="camera frame height (default: camera default)"
+    )
+    parser.add_argument("--camera_fps", type=float, default=None, help="camera frame rate (default: camera default)")
+    parser.add_argument(
+        "--camera_fourcc", type=str, default=None, help="camera pixel format such as MJPG (default: camera default)"
+    )
+    parser.add_argument(
+        "--camera_buffer_size", type=int, default=None, help="frames buffered by the camera driver (default: driver)"
+    )
+    parser.add_argument(
+        "--record", type=str, default=None, help="record frames, landmarks and timestamps to this directory"
+    )
+    parser.add_argument(
+        "--replay", type=str, default=None, help="replay a directory recorded by --record instead of the camera"
+    )
+    parser.add_argument(
+        "--replay_max_speed",
+        action="store_true",
+        help="replay as fast as possible instead of the recorded speed if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--replay_landmarks",
+        action="store_true",
+        help="replay recorded landmarks without decoding frames nor inference if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help=f"send frames as MJPEG over HTTP ({IMake.STREAM_PATH}) instead of base64 data URLs if this flag is set",
+    )
+    parser.add_argument("--jpeg_quality", type=int, default=95, help="highest JPEG quality (default: 95)")
+    parser.add_argument(
+        "--encode_budget_ms",
+        type=float,
+        default=None,
+        help="lower JPEG quality to keep encode time per frame under this (ms) (default: fixed quality)",
+    )
+    parser.add_argument(
+        "--target_bitrate",
+        type=float,
+        default=None,
+        help="lower JPEG quality to keep the stream under this bitrate (kbps) (default: fixed quality)",
+    )
+    parser.add_argument(
+        "--projector",
+        action="store_true",
+        help="show frames on a native fullscreen window instead of the browser if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--projector_position",
+        type=int,
+        nargs=2,
+        default=(0, 0),
+        metavar=("X", "Y"),
+        help="top left of the projector display in the virtual desktop (default: 0 0)",
+    )
+    parser.add_argument(
+        "--projector_refresh_rate", type=float, default=60.0, help="refresh rate of the projector (Hz) (default: 60)"
+    )
+    parser.add_argument(
+        "--crop_output",
+        action="store_true",
+        help="send only the bounding box of non-black pixels with its offset if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--direct_render",
+        action="store_true",
+        help="warp the effect directly into the output image in one resample if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--buffer_pool",
+        action="store_true",
+        help="reuse large per-frame arrays from a pool keyed by shape if this flag is set (default: False)",
+    )
+    parser.add_argument(
+        "--calibration",
+        type=str,
+        default=None,
+        help="load and save the projector-camera homography of start_calibration in this file (.npz). "
+        "clear_calibration renames it to <file>.bak",
+    )
+    parser.add_argument(
+        "--render_workers", type=int, default=None, help="number of threads for PARALLEL warp engine (default: CPUs)"
+    )
     args = parser.parse_args()
 
     imake = IMake(
@@ -547,6 +1533,40 @@ def main() -> None:
         scale=args.scale,
         effect_width=args.effect_width,
         debug=args.debug,
+        warp_engine=WarpEngine[args.warp_engine],
+        render_workers=args.render_workers,
+        cull_triangles=args.cull_triangles,
+        adaptive_lod=args.adaptive_lod,
+        reuse_threshold=args.reuse_threshold,
+        rigid_reuse_threshold=args.rigid_reuse_threshold,
+        use_mipmap=args.use_mipmap,
+        max_num_faces=args.max_num_faces,
+        single_inference=args.single_inference,
+        refine_interval=args.refine_interval,
+        keyframe_interval=args.keyframe_interval,
+        use_pipeline=args.pipeline,
+        pipeline_queue_size=args.pipeline_queue_size,
+        inference_workers=args.inference_workers,
+        camera_width=args.camera_width,
+        camera_height=args.camera_height,
+        camera_fps=args.camera_fps,
+        camera_fourcc=args.camera_fourcc,
+        camera_buffer_size=args.camera_buffer_size,
+        record_path=args.record,
+        replay_path=args.replay,
+        replay_max_speed=args.replay_max_speed,
+        replay_landmarks=args.replay_landmarks,
+        stream=args.stream,
+        jpeg_quality=args.jpeg_quality,
+        encode_budget_ms=args.encode_budget_ms,
+        target_bitrate=None if args.target_bitrate is None else args.target_bitrate * 1000 / 8,
+        projector=args.projector,
+        projector_position=tuple(args.projector_position),
+        projector_refresh_rate=args.projector_refresh_rate,
+        crop_output=args.crop_output,
+        direct_render=args.direct_render,
+        use_buffer_pool=args.buffer_pool,
+        calibration_path=args.calibration,
     )
 
     eel.init("imake/static")
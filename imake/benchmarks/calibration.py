@@ -0,0 +1,96 @@
+"""既知のホモグラフィでチェスボードをカメラ画像に写し、find_homographyが同じ対応を求めるかを確かめる.
+
+python -m imake.benchmarks.calibration --trials 40
+"""
+
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from ..libs.calibration import create_chessboard, find_homography
+
+OUTPUT_SIZE = (960, 1080)  # (width, height) of the output image (IMake.RENDER_IMAGE_WIDTH/HEIGHT)
+CAMERA_SIZE = (1280, 720)  # (width, height) of the camera image
+MAX_ERROR = 2.0  # カメラ画像上で許容する誤差(px). 向きを間違えると数百px以上になる
+
+
+def create_homography(rng: np.random.Generator) -> np.ndarray:
+    """出力画像をカメラ画像の中に、回転・傾き・遠近をつけて写すホモグラフィを作る.
+
+    Args:
+        rng (np.random.Generator): random generator
+
+    Returns:
+        np.ndarray: homography from the output image to the camera image (3 x 3)
+    """
+    width, height = OUTPUT_SIZE
+    camera_width, camera_height = CAMERA_SIZE
+    scale = rng.uniform(0.45, 0.6) * camera_height / height
+    angle = np.deg2rad(rng.uniform(-15, 15))
+    center = np.array([camera_width / 2, camera_height / 2]) + rng.uniform(-60, 60, 2)
+    corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], np.float64)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    camera_corners = (corners - (width / 2, height / 2)) * scale @ rotation.T + center
+    camera_corners += rng.uniform(-20, 20, camera_corners.shape)  # 遠近
+    return cv2.getPerspectiveTransform(corners.astype(np.float32), camera_corners.astype(np.float32))
+
+
+def project(pattern: np.ndarray, homography: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Simulate the camera image capturing the projected pattern.
+
+    Args:
+        pattern (np.ndarray): pattern image (BGR)
+        homography (np.ndarray): homography from the output image to the camera image
+        rng (np.random.Generator): random generator
+
+    Returns:
+        np.ndarray: camera image (BGR)
+    """
+    camera_image = cv2.warpPerspective(pattern, homography, CAMERA_SIZE, borderValue=(90, 90, 90))
+    camera_image = cv2.GaussianBlur(camera_image, (3, 3), 0).astype(np.float32) * 0.8 + 20
+    camera_image += rng.normal(0, 4, camera_image.shape)
+    return np.clip(camera_image, 0, 255).astype(np.uint8)
+
+
+def get_error(homography: np.ndarray, found: np.ndarray) -> float:
+    """出力画像の点を正しいホモグラフィと求めたホモグラフィでカメラ画像に写したときのずれの最大値.
+
+    Args:
+        homography (np.ndarray): true homography from the output image to the camera image
+        found (np.ndarray): found homography from the camera image to the output image
+
+    Returns:
+        float: maximum error on the camera image (px)
+    """
+    width, height = OUTPUT_SIZE
+    grid_x, grid_y = np.meshgrid(np.linspace(0, width, 5), np.linspace(0, height, 5))
+    points = np.stack([grid_x, grid_y], axis=-1).reshape(1, -1, 2)
+    expected = cv2.perspectiveTransform(points, homography)
+    mapped = cv2.perspectiveTransform(points, np.linalg.inv(found))
+    return float(np.linalg.norm(mapped - expected, axis=2).max())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="check of the projector calibration")
+    parser.add_argument("--trials", type=int, default=40, help="number of random homographies")
+    args = parser.parse_args()
+
+    pattern, pattern_corners = create_chessboard(*OUTPUT_SIZE)
+    rng = np.random.default_rng(0)
+    failures = 0
+    for i in range(args.trials):
+        homography = create_homography(rng)
+        found = find_homography(project(pattern, homography, rng), pattern, pattern_corners)
+        error = np.inf if found is None else get_error(homography, found)
+        if error > MAX_ERROR:
+            failures += 1
+            print(f"trial {i}: NG (error {error:.1f} px)")
+    print(f"{args.trials - failures}/{args.trials} OK")
+    if failures > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
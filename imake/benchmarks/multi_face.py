@@ -0,0 +1,129 @@
+"""複数の顔を1回で描画した結果が、顔ごとに描画した結果と一致するかを確かめ、描画時間を比較する.
+
+refine_landmarks=Trueのランドマーク(虹彩を含む478個)を模した、重ならない顔を並べて使う.
+
+python -m imake.benchmarks.multi_face --faces 3
+"""
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from ..libs.effect import Effect, WarpEngine
+
+OUTPUT_SIZE = (960, 1080)  # (width, height) of the output image
+NUM_LANDMARKS = 478  # refine_landmarks=TrueのFaceMeshが返すランドマークの数
+# 顔1つあたりに許容する違う画素の数. WarpEngine.REMAPはremapのテーブルを描画範囲の左上からの座標でfloat32で計算するので、
+# 描画範囲が変わると三角形の縁の数画素が丸めで変わる (ランドマークのindexがずれると数万画素になる)
+MAX_DIFFERENT_PIXELS_PER_FACE = 8
+# 1回で描画する時間が、顔ごとに描画する時間の合計のこの倍率を超えたら失敗にする (時間の揺らぎの分だけ余裕を持たせる)
+MAX_STACKED_TIME_RATIO = 1.05
+
+
+def create_faces(src_points: np.ndarray, num_faces: int) -> np.ndarray:
+    """エフェクト画像のランドマークを縮小・回転し、出力画像に重ならないように並べる.
+
+    Args:
+        src_points (np.ndarray): source landmarks on the effect image (N x 2)
+        num_faces (int): number of faces
+
+    Returns:
+        np.ndarray: landmarks (faces x NUM_LANDMARKS x 3). N以降(虹彩)は目の周りの適当な点で埋める
+    """
+    width, height = OUTPUT_SIZE
+    rng = np.random.default_rng(0)
+    center = src_points.mean(axis=0)
+    cell_height = height / num_faces
+    scale = 0.8 * min(width, cell_height) / np.ptp(src_points, axis=0).max()
+    faces = np.zeros((num_faces, NUM_LANDMARKS, 3), np.float32)
+    for i in range(num_faces):
+        angle = np.deg2rad(rng.uniform(-10, 10))
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        points = (src_points - center) @ rotation.T * scale + (width / 2, cell_height * (i + 0.5))
+        faces[i, : len(points), :2] = points
+        faces[i, len(points) :, :2] = points[rng.integers(0, len(points), NUM_LANDMARKS - len(points))]
+        faces[i, :, 2] = rng.normal(0, 0.02, NUM_LANDMARKS)
+    return faces
+
+
+def render(effect: Effect, landmarks: np.ndarray) -> tuple[np.ndarray, float]:
+    """Render the landmarks and measure the time.
+
+    Args:
+        effect (Effect): effect
+        landmarks (np.ndarray): landmarks (faces x landmarks x 3) or (landmarks x 3)
+
+    Returns:
+        tuple[np.ndarray, float]: (effect image, time (s))
+    """
+    canvas = np.zeros((OUTPUT_SIZE[1], OUTPUT_SIZE[0], 3), np.uint8)
+    start_time = time.perf_counter()
+    overlay = effect.create_effect(canvas, landmarks)
+    return overlay, time.perf_counter() - start_time
+
+
+def compare(effect: Effect, faces: np.ndarray, repeat: int) -> tuple[int, float, float]:
+    """全ての顔を1回で描画した結果と、顔ごとに描画して足し合わせた結果を比べる.
+
+    時間は両方を交互に測り、他の処理の影響を除くため最小値を使う.
+
+    Args:
+        effect (Effect): effect
+        faces (np.ndarray): landmarks (faces x landmarks x 3)
+        repeat (int): number of measurements
+
+    Returns:
+        tuple[int, float, float]: (number of different pixels, stacked time (s), per-face time (s))
+    """
+    stacked_times, per_face_times = [], []
+    for _ in range(max(repeat, 1)):
+        stacked, stacked_time = render(effect, faces)
+        stacked = stacked.copy()
+        per_face = np.zeros_like(stacked)
+        per_face_time = 0.0
+        for face in faces:
+            overlay, face_time = render(effect, face)
+            per_face += overlay  # 顔は重ならないので、足し合わせれば1枚になる
+            per_face_time += face_time
+        stacked_times.append(stacked_time)
+        per_face_times.append(per_face_time)
+    return int((stacked != per_face).any(axis=2).sum()), min(stacked_times), min(per_face_times)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="check and benchmark of multi-face rendering")
+    parser.add_argument("--effect_image", type=str, default="imake/static/modes/config/sample.png", help="BGRA image")
+    parser.add_argument("--faces", type=int, default=3, help="number of faces")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measurements")
+    args = parser.parse_args()
+
+    effect_image = cv2.imread(args.effect_image, cv2.IMREAD_UNCHANGED)
+    if effect_image.shape[2] == 3:
+        effect_image = cv2.cvtColor(effect_image, cv2.COLOR_BGR2BGRA)
+    failed = False
+    for options in [{"warp_engine": engine} for engine in WarpEngine] + [
+        {"cull_triangles": True},
+        {"use_mipmap": True},
+        {"adaptive_lod": True},
+    ]:
+        effect = Effect(effect_image, **options)  # type: ignore
+        faces = create_faces(effect.src_points, args.faces)
+        different_pixels, stacked_time, per_face_time = compare(effect, faces, args.repeat)
+        # 画素が一致し、かつ1回で描画する方が遅くないこと
+        ok = different_pixels <= MAX_DIFFERENT_PIXELS_PER_FACE * args.faces
+        ok &= stacked_time <= per_face_time * MAX_STACKED_TIME_RATIO
+        failed |= not ok
+        name = ", ".join(f"{key}={getattr(value, 'name', value)}" for key, value in options.items())
+        print(
+            f"{name}: {'OK' if ok else 'NG'} ({different_pixels} different pixels), "
+            f"stacked {stacked_time * 1000:.2f} ms, per face {per_face_time * 1000:.2f} ms"
+        )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
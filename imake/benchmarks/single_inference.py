@@ -0,0 +1,133 @@
+"""2回推論する場合とCropMapperで1回だけ推論する場合の、遅延とランドマークの誤差を比較する.
+
+python -m imake.benchmarks.single_inference --video face.mp4
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from ..libs.crop import CropMapper, crop_face
+from ..libs.facemesh import FaceMesh
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="benchmark of single inference mode")
+    parser.add_argument("--video", type=str, default=None, help="video file (default: camera)")
+    parser.add_argument("--camera_id", type=int, default=0, help="camera id")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames")
+    parser.add_argument("--effect_width", type=int, default=400, help="effect width")
+    parser.add_argument("--refine_interval", type=int, default=10, help="refine interval of the refined mapper")
+    return parser.parse_args()
+
+
+def measure_frame(
+    image: np.ndarray,
+    face_mesh: FaceMesh,
+    face_mesh2: FaceMesh,
+    mappers: dict[str, CropMapper],
+    effect_width: int,
+) -> tuple[float, dict[str, float], dict[str, float]] | None:
+    """1フレームについて、2回目の推論とCropMapperの時間、CropMapperの誤差を測る.
+
+    Args:
+        image (np.ndarray): camera image
+        face_mesh (FaceMesh): face mesh for the camera image
+        face_mesh2 (FaceMesh): face mesh for the cropped face
+        mappers (dict[str, CropMapper]): mappers to measure
+        effect_width (int): width of the resized face
+
+    Returns:
+        tuple[float, dict[str, float], dict[str, float]] | None:
+            (second inference time (s), mapper times (s), mapper errors (px)). None if no face is detected.
+    """
+    try:
+        original_landmarks = face_mesh.get_landmarks(image)
+    except Exception:
+        return None
+    crop = crop_face(image, original_landmarks, effect_width)
+
+    start_time = time.perf_counter()
+    try:
+        landmarks = face_mesh2.get_landmarks(crop.resized)
+    except Exception:
+        return None
+    two_pass_time = time.perf_counter() - start_time
+
+    times = {}
+    errors = {}
+    for name, mapper in mappers.items():
+        start_time = time.perf_counter()
+        mapped = mapper.map_crop(original_landmarks, crop, image.shape[1])
+        if mapper.needs_refinement():
+            mapper.refine(mapped, face_mesh2.get_landmarks(crop.resized), crop.crop_size)
+        times[name] = time.perf_counter() - start_time
+        errors[name] = float(np.linalg.norm(mapped[:, :2] - landmarks[:, :2], axis=1).mean())
+    return two_pass_time, times, errors
+
+
+def measure(
+    cap: cv2.VideoCapture, mappers: dict[str, CropMapper], frames: int, effect_width: int
+) -> tuple[list[float], dict[str, list[float]], dict[str, list[float]]]:
+    """Measure the frames of the capture.
+
+    Args:
+        cap (cv2.VideoCapture): video or camera
+        mappers (dict[str, CropMapper]): mappers to measure
+        frames (int): number of frames
+        effect_width (int): width of the resized face
+
+    Returns:
+        tuple[list[float], dict[str, list[float]], dict[str, list[float]]]:
+            (second inference times (s), mapper times (s), mapper errors (px))
+    """
+    face_mesh = FaceMesh(refine_landmarks=True)
+    face_mesh2 = FaceMesh(refine_landmarks=True)
+    two_pass_times: list[float] = []
+    times: dict[str, list[float]] = {name: [] for name in mappers}
+    errors: dict[str, list[float]] = {name: [] for name in mappers}
+    for _ in range(frames):
+        ret, image = cap.read()
+        if not ret:
+            break
+        result = measure_frame(image, face_mesh, face_mesh2, mappers, effect_width)
+        if result is None:
+            continue
+        two_pass_times.append(result[0])
+        for name in mappers:
+            times[name].append(result[1][name])
+            errors[name].append(result[2][name])
+    face_mesh.close()
+    face_mesh2.close()
+    return two_pass_times, times, errors
+
+
+def print_results(two_pass_times: list[float], times: dict[str, list[float]], errors: dict[str, list[float]]) -> None:
+    if not two_pass_times:
+        print("No face detected.")
+        return
+
+    print(f"frames: {len(two_pass_times)}")
+    print(f"two-pass: {np.mean(two_pass_times) * 1000:.2f} ms/frame (second inference)")
+    for name in times:
+        print(
+            f"{name}: {np.mean(times[name]) * 1000:.2f} ms/frame, "
+            f"error {np.mean(errors[name]):.2f} px (max {np.max(errors[name]):.2f} px)"
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    cap = cv2.VideoCapture(args.video if args.video is not None else args.camera_id)
+    mappers = {"mapped": CropMapper(), f"refined(every {args.refine_interval})": CropMapper(args.refine_interval)}
+    try:
+        results = measure(cap, mappers, args.frames, args.effect_width)
+    finally:
+        cap.release()
+    print_results(*results)
+
+
+if __name__ == "__main__":
+    main()
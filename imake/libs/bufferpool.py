@@ -0,0 +1,94 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Final
+
+import numpy as np
+
+
+def _get_refcount(buffers: list[np.ndarray], index: int) -> int:
+    """buffers[index]の参照カウントを取得する. (_FREE_REFCOUNTと同じ呼び出し方で比べる)"""
+    return sys.getrefcount(buffers[index])
+
+
+# プールのリストからしか参照されていない(どこでも使われていない)バッファの参照カウント
+_FREE_REFCOUNT: Final = _get_refcount([np.empty(0)], 0)
+
+
+class BufferPool:
+    """shapeとdtypeごとにバッファを使い回すプール (スレッドセーフ).
+
+    返したバッファは、プール以外からの参照(ビューを含む)がなくなった時点で自動的に再利用される.
+    パイプラインのキューやエンコーダーが持っている間は再利用されないので、明示的に返却する必要はない.
+    """
+
+    def __init__(self, max_buffers: int = 8, max_shapes: int = 16):
+        """Initialize BufferPool.
+
+        Args:
+            max_buffers (int, optional): maximum buffers kept for each shape and dtype. Defaults to 8.
+            max_shapes (int, optional): maximum shapes and dtypes kept. Defaults to 16.
+                (超えたら最も長く使われていないものを捨てる. 顔の大きさで変わるshapeがプールを埋めないように)
+        """
+        self.max_buffers = max_buffers
+        self.max_shapes = max_shapes
+        self.buffers: OrderedDict[tuple[tuple[int, ...], np.dtype], list[np.ndarray]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def empty(self, shape: tuple[int, ...], dtype: np.dtype | type = np.uint8) -> np.ndarray:
+        """Get a buffer. (np.emptyと同じく、中身は初期化しない)
+
+        Args:
+            shape (tuple[int, ...]): shape
+            dtype (np.dtype | type, optional): dtype. Defaults to np.uint8.
+
+        Returns:
+            np.ndarray: buffer
+        """
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            buffers = self.buffers.setdefault(key, [])
+            self.buffers.move_to_end(key)
+            for i in range(len(buffers)):
+                if _get_refcount(buffers, i) <= _FREE_REFCOUNT:
+                    self.hit_count += 1
+                    return buffers[i]
+
+            self.miss_count += 1
+            buffer = np.empty(key[0], key[1])
+            if len(buffers) < self.max_buffers:  # 全て使われている場合は、プールに入れずに返す
+                buffers.append(buffer)
+            while len(self.buffers) > self.max_shapes:
+                self.buffers.popitem(last=False)
+            return buffer
+
+    def zeros(self, shape: tuple[int, ...], dtype: np.dtype | type = np.uint8) -> np.ndarray:
+        """Get a buffer filled with zeros.
+
+        Args:
+            shape (tuple[int, ...]): shape
+            dtype (np.dtype | type, optional): dtype. Defaults to np.uint8.
+
+        Returns:
+            np.ndarray: buffer
+        """
+        buffer = self.empty(shape, dtype)
+        buffer.fill(0)
+        return buffer
+
+    def get_stats(self) -> dict[str, int]:
+        """Get hit and miss counts and the pooled buffers.
+
+        Returns:
+            dict[str, int]: stats
+        """
+        with self.lock:
+            buffers = [buffer for shape_buffers in self.buffers.values() for buffer in shape_buffers]
+            return {
+                "hit_count": self.hit_count,
+                "miss_count": self.miss_count,
+                "buffer_count": len(buffers),
+                "pooled_bytes": sum(buffer.nbytes for buffer in buffers),
+            }
@@ -0,0 +1,198 @@
+from typing import Final
+
+import cv2
+import numpy as np
+
+# チェスボードの内側の角の数 (列, 行). 色の並びは左右反転・180度回転では変わるが、上下反転では変わらないので、
+# 左上のマスに目印を描いて向きを判別する
+PATTERN_SIZE: Final = (9, 6)
+PATTERN_MARGIN: Final = 60  # 出力画像の端からチェスボードまでの余白(px)
+
+
+def create_chessboard(width: int, height: int) -> tuple[np.ndarray, np.ndarray]:
+    """Create a chessboard pattern to project.
+
+    Args:
+        width (int): width of the output image
+        height (int): height of the output image
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (pattern image(BGR), inner corners on the pattern (N x 2, 行ごとに左から))
+    """
+    cols, rows = PATTERN_SIZE
+    square = min((width - 2 * PATTERN_MARGIN) // (cols + 1), (height - 2 * PATTERN_MARGIN) // (rows + 1))
+    left = (width - square * (cols + 1)) // 2
+    top = (height - square * (rows + 1)) // 2
+
+    # 検出には白い余白が必要なので、背景を白にする
+    pattern = np.full((height, width, 3), 255, np.uint8)
+    for j in range(rows + 1):
+        for i in range(cols + 1):
+            if (i + j) % 2 == 0:
+                x, y = left + i * square, top + j * square
+                pattern[y : y + square, x : x + square] = 0
+
+    grid_x, grid_y = np.meshgrid(np.arange(1, cols + 1), np.arange(1, rows + 1))
+    corners = np.stack([left + grid_x * square, top + grid_y * square], axis=-1).reshape(-1, 2).astype(np.float32)
+
+    # 目印: 内側の角に囲まれた左上のマス(黒)の中心に白い円 (find_homographyはマスの中心の色で向きを選ぶ)
+    marker_center = (left + square + square // 2, top + square + square // 2)
+    cv2.circle(pattern, marker_center, square // 4, (255, 255, 255), -1, cv2.LINE_AA)
+    return pattern, corners
+
+
+def find_homography(camera_image: np.ndarray, pattern: np.ndarray, pattern_corners: np.ndarray) -> np.ndarray | None:
+    """Find the homography from the camera image to the output image by the projected chessboard.
+
+    Args:
+        camera_image (np.ndarray): camera image(BGR) capturing the projected pattern
+        pattern (np.ndarray): pattern image created by create_chessboard
+        pattern_corners (np.ndarray): inner corners created by create_chessboard
+
+    Returns:
+        np.ndarray | None: homography (3 x 3). None if the pattern is not found.
+    """
+    gray = cv2.cvtColor(camera_image, cv2.COLOR_BGR2GRAY)
+    found, corners = cv2.findChessboardCorners(gray, PATTERN_SIZE)
+    if not found:
+        return None
+    corners = cv2.cornerSubPix(
+        gray, corners, (5, 5), (-1, -1), (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+    )
+
+    # 検出した角の並び順は、チェスボードの対称性の分だけ(反転・180度回転)あいまいなので、
+    # 各並び順でパターンのマスの中心をカメラ画像に写し、最も一致するものを選ぶ (上下反転は目印のマスだけで区別される)
+    cols, rows = PATTERN_SIZE
+    grid = corners.reshape(rows, cols, 2)
+    samples = _get_square_centers(pattern_corners)
+    expected = pattern[samples[:, 1].astype(int), samples[:, 0].astype(int), 0].astype(np.float64)
+    best_homography, best_score = None, -np.inf
+    for candidate in (grid, grid[::-1], grid[:, ::-1], grid[::-1, ::-1]):
+        homography, _ = cv2.findHomography(candidate.reshape(-1, 2), pattern_corners, cv2.RANSAC)
+        if homography is None:
+            continue
+        camera_samples = cv2.perspectiveTransform(samples[np.newaxis], np.linalg.inv(homography))[0]
+        inside = (
+            (camera_samples[:, 0] >= 0)
+            & (camera_samples[:, 0] < gray.shape[1] - 1)
+            & (camera_samples[:, 1] >= 0)
+            & (camera_samples[:, 1] < gray.shape[0] - 1)
+        )
+        if inside.sum() < 2:
+            continue
+        observed = gray[camera_samples[inside, 1].astype(int), camera_samples[inside, 0].astype(int)]
+        score = np.corrcoef(expected[inside], observed)[0, 1]
+        if score > best_score:
+            best_homography, best_score = homography, score
+    return best_homography
+
+
+def _get_square_centers(pattern_corners: np.ndarray) -> np.ndarray:
+    """内側の角に囲まれたマスの中心を求める.
+
+    Args:
+        pattern_corners (np.ndarray): inner corners created by create_chessboard
+
+    Returns:
+        np.ndarray: centers of the squares (M x 2)
+    """
+    cols, rows = PATTERN_SIZE
+    grid = pattern_corners.reshape(rows, cols, 2)
+    return ((grid[:-1, :-1] + grid[1:, 1:]) / 2).reshape(-1, 2).astype(np.float32)
+
+
+class ProjectorCalibration:
+    """カメラ画像から出力画像(プロジェクター)へのホモグラフィ.
+
+    出力画像の各画素に対応するカメラ画像の座標を最初にremapのテーブルにしておき、位置合わせを1回のremapで行う.
+    """
+
+    def __init__(self, homography: np.ndarray, output_size: tuple[int, int]):
+        """Initialize ProjectorCalibration.
+
+        Args:
+            homography (np.ndarray): homography from the camera image to the output image (3 x 3)
+            output_size (tuple[int, int]): (width, height) of the output image
+        """
+        self.homography = homography
+        self.output_size = output_size
+
+        width, height = output_size
+        grid = np.stack(np.meshgrid(np.arange(width), np.arange(height)), axis=-1).astype(np.float64)
+        camera_points = cv2.perspectiveTransform(grid.reshape(1, -1, 2), np.linalg.inv(homography))[0]
+        map_x = camera_points[:, 0].reshape(height, width).astype(np.float32)
+        map_y = camera_points[:, 1].reshape(height, width).astype(np.float32)
+        # 固定小数点のテーブルにすると、remapが速くなる
+        self.map1, self.map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+    @classmethod
+    def load(cls, path: str, output_size: tuple[int, int]) -> "ProjectorCalibration":
+        """Load the homography saved by save.
+
+        Args:
+            path (str): file path (.npz)
+            output_size (tuple[int, int]): (width, height) of the output image
+
+        Returns:
+            ProjectorCalibration: calibration
+        """
+        return cls(np.load(path)["homography"], output_size)
+
+    def save(self, path: str) -> None:
+        """Save the homography.
+
+        Args:
+            path (str): file path (.npz)
+        """
+        with open(path, "wb") as f:  # ファイル名に.npzを付け足さないように、ファイルオブジェクトに書く
+            np.savez(f, homography=self.homography)
+
+    def warp(
+        self, image: np.ndarray, dst: np.ndarray | None = None, rect: tuple[int, int, int, int] | None = None
+    ) -> np.ndarray:
+        """Warp an image on the camera image to the output image.
+
+        Args:
+            image (np.ndarray): image with the same size as the camera image
+            dst (np.ndarray | None, optional): output buffer. Defaults to None.
+            rect (tuple[int, int, int, int] | None, optional): (x, y, width, height) on the camera image outside of
+                which the image is black. Defaults to None. (指定すると、対応する出力画像の範囲だけremapする)
+
+        Returns:
+            np.ndarray: image on the output image
+        """
+        width, height = self.output_size
+        if rect is None:
+            return cv2.remap(
+                image,
+                self.map1,
+                self.map2,
+                cv2.INTER_LINEAR,
+                dst=dst,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=(0, 0, 0, 0),
+            )
+
+        if dst is None:
+            dst = np.zeros((height, width) + image.shape[2:], image.dtype)
+        else:
+            dst.fill(0)
+        x, y, w, h = rect
+        corners = np.array([[x, y], [x + w, y], [x, y + h], [x + w, y + h]], np.float64)
+        # ホモグラフィで写した矩形の外接矩形 (補間で参照する1画素分を広げる)
+        output_corners = cv2.perspectiveTransform(corners[np.newaxis], self.homography)[0]
+        left, top = np.maximum(np.floor(output_corners.min(axis=0)).astype(int) - 1, 0)
+        right = min(int(np.ceil(output_corners[:, 0].max())) + 2, width)
+        bottom = min(int(np.ceil(output_corners[:, 1].max())) + 2, height)
+        if left >= right or top >= bottom:
+            return dst
+        cv2.remap(
+            image,
+            self.map1[top:bottom, left:right],
+            self.map2[top:bottom, left:right],
+            cv2.INTER_LINEAR,
+            dst=dst[top:bottom, left:right],
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0, 0),
+        )
+        return dst
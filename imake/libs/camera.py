@@ -0,0 +1,123 @@
+import threading
+import time
+from typing import Final
+
+import cv2
+import numpy as np
+
+
+class Camera:
+    """専用のスレッドでカメラを読み続け、常に最新のフレームを渡す.
+
+    cv2.VideoCaptureのread/get/releaseと同じように使える. 読み出されずに次のフレームで上書きされたものは
+    dropped_countに数える.
+    """
+
+    FPS_SMOOTHING: Final = 0.1  # capture_fpsの指数移動平均の重み
+    READ_TIMEOUT: Final = 1.0  # 新しいフレームを待つ上限(秒)
+    RETRY_INTERVAL: Final = 0.1  # フレームを読み込めなかったときに、再び読み込むまでの時間(秒)
+
+    def __init__(
+        self,
+        camera_id: int,
+        width: int | None = None,
+        height: int | None = None,
+        fps: float | None = None,
+        fourcc: str | None = None,
+        buffer_size: int | None = None,
+    ):
+        """Open the camera and start the reader thread.
+
+        Args:
+            camera_id (int): camera id
+            width (int | None, optional): frame width. Defaults to None. (If None, camera default)
+            height (int | None, optional): frame height. Defaults to None. (If None, camera default)
+            fps (float | None, optional): frame rate. Defaults to None. (If None, camera default)
+            fourcc (str | None, optional): pixel format such as "MJPG". Defaults to None. (If None, camera default)
+            buffer_size (int | None, optional): number of frames buffered by the driver. Defaults to None.
+        """
+        self.cap = cv2.VideoCapture(camera_id)
+        if fourcc is not None:  # 解像度より先に設定しないと反映されないカメラがある
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if width is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height is not None:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps is not None:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        if buffer_size is not None:
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+
+        self.condition = threading.Condition()
+        self.frame: np.ndarray | None = None
+        self.timestamp = 0.0  # self.frameを読み込んだ時刻 (time.time())
+        self.frame_count = 0  # 読み込んだフレームの数
+        self.last_read_count = 0  # 最後にreadで渡したフレームの番号
+        self.dropped_count = 0
+        self.capture_fps = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="camera", daemon=True)
+        self.thread.start()
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        """Get the newest frame. (cv2.VideoCapture.readと同じ形式)
+
+        Returns:
+            tuple[bool, np.ndarray | None]: (success, frame)
+        """
+        try:
+            frame, _ = self.read_with_timestamp()
+        except Exception:
+            return False, None
+        return True, frame
+
+    def read_with_timestamp(self) -> tuple[np.ndarray, float]:
+        """前回readしたものより新しいフレームを待って、最新のフレームを取得する.
+
+        Returns:
+            tuple[np.ndarray, float]: (frame, time when the frame was captured)
+        """
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.frame_count > self.last_read_count or not self.running, self.READ_TIMEOUT
+            ):
+                raise Exception("Failed to get image")
+            if self.frame is None or self.frame_count == self.last_read_count:
+                raise Exception("Failed to get image")
+            self.dropped_count += self.frame_count - self.last_read_count - 1
+            self.last_read_count = self.frame_count
+            return self.frame, self.timestamp
+
+    def get(self, prop_id: int) -> float:
+        """Get a property of the camera. (cv2.VideoCapture.get)
+
+        Args:
+            prop_id (int): property id
+
+        Returns:
+            float: value
+        """
+        return self.cap.get(prop_id)
+
+    def release(self) -> None:
+        """Stop the reader thread and release the camera."""
+        self.running = False
+        self.thread.join()
+        self.cap.release()
+
+    def _run(self) -> None:
+        """フレームを読み続ける."""
+        while self.running:
+            ret, frame = self.cap.read()
+            now = time.time()
+            if not ret:
+                time.sleep(self.RETRY_INTERVAL)
+                continue
+            with self.condition:
+                if self.frame_count > 0 and now > self.timestamp:
+                    fps = 1.0 / (now - self.timestamp)
+                    self.capture_fps += self.FPS_SMOOTHING * (fps - self.capture_fps)
+                self.frame = frame
+                self.timestamp = now
+                self.frame_count += 1
+                self.condition.notify_all()
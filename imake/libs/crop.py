@@ -0,0 +1,137 @@
+from dataclasses import dataclass
+from typing import Final
+
+import cv2
+import numpy as np
+
+
+@dataclass(frozen=True)
+class FaceCrop:
+    """カメラ画像から切り取って、幅をeffect_widthにリサイズした顔."""
+
+    face: np.ndarray  # 切り取った顔
+    resized: np.ndarray  # faceをリサイズしたもの
+    offset: tuple[int, int]  # 切り取った範囲の左上 (left, top) (カメラ画像の座標)
+    width: int  # 切り取った範囲の幅 (カメラ画像の座標)
+    center: tuple[int, int]  # 切り取った範囲の中心 (カメラ画像の座標)
+
+    @property
+    def crop_size(self) -> tuple[int, int]:
+        """(width, height) of the resized face."""
+        return self.resized.shape[1], self.resized.shape[0]
+
+    @property
+    def resize_factor(self) -> tuple[float, float]:
+        """(x, y) resize factor from the face to the resized face."""
+        return self.resized.shape[1] / self.face.shape[1], self.resized.shape[0] / self.face.shape[0]
+
+
+def crop_face(image: np.ndarray, landmarks: np.ndarray, effect_width: int) -> FaceCrop:
+    """ランドマークの外接矩形で顔を切り取り、幅をeffect_widthにリサイズする.
+
+    Args:
+        image (np.ndarray): camera image
+        landmarks (np.ndarray): landmarks on the camera image (N x 3)
+        effect_width (int): width of the resized face
+
+    Returns:
+        FaceCrop: cropped face
+    """
+    face_left = int(np.amin(landmarks[:, 0]))
+    face_right = int(np.amax(landmarks[:, 0]))
+    face_top = int(np.amin(landmarks[:, 1]))
+    face_bottom = int(np.amax(landmarks[:, 1]))
+    face = image[face_top:face_bottom, face_left:face_right]
+    resized = cv2.resize(face, (effect_width, int(effect_width * face.shape[0] / face.shape[1])))
+    return FaceCrop(
+        face=face,
+        resized=resized,
+        offset=(face_left, face_top),
+        width=face_right - face_left,
+        center=(int((face_left + face_right) / 2), int((face_top + face_bottom) / 2)),
+    )
+
+
+class CropMapper:
+    """カメラ画像のランドマークを、顔を切り取ってリサイズした画像の座標に変換する.
+
+    切り取った画像でもう一度推論する代わりに使う. refine_intervalを指定すると、その間隔で2回目の推論を行い、
+    変換したランドマークとの差(切り取った画像の大きさで正規化)を補正量として学習する.
+    """
+
+    REFINE_WEIGHT: Final = 0.3  # 補正量を更新するときの新しい差の重み (指数移動平均)
+
+    def __init__(self, refine_interval: int | None = None):
+        """Initialize CropMapper.
+
+        Args:
+            refine_interval (int | None, optional): 2回目の推論で補正量を更新するフレーム間隔. Defaults to None.
+                (If None, do not refine)
+        """
+        self.refine_interval = refine_interval
+        self.frame_count = 0
+        self.correction: np.ndarray | None = None  # ランドマークごとの補正量 (N x 2, 切り取った画像の幅・高さに対する割合)
+
+    def map(
+        self,
+        landmarks: np.ndarray,
+        offset: tuple[int, int],
+        resize_factor: tuple[float, float],
+        crop_size: tuple[int, int],
+        image_width: int,
+    ) -> np.ndarray:
+        """Map landmarks on the camera image to the cropped and resized image.
+
+        Args:
+            landmarks (np.ndarray): landmarks on the camera image (N x 3)
+            offset (tuple[int, int]): (left, top) of the crop on the camera image
+            resize_factor (tuple[float, float]): (x, y) resize factor of the crop
+            crop_size (tuple[int, int]): (width, height) of the resized crop
+            image_width (int): width of the camera image
+
+        Returns:
+            np.ndarray: landmarks on the resized crop (N x 3)
+        """
+        self.frame_count += 1
+        mapped = np.empty(landmarks.shape, np.float32)
+        mapped[:, 0] = (landmarks[:, 0] - offset[0]) * resize_factor[0]
+        mapped[:, 1] = (landmarks[:, 1] - offset[1]) * resize_factor[1]
+        # zは推論した画像の幅で正規化されているので、切り取った画像で推論した場合の値に合わせる
+        mapped[:, 2] = landmarks[:, 2] * image_width * resize_factor[0] / crop_size[0]
+        if self.correction is not None and self.correction.shape[0] == mapped.shape[0]:
+            mapped[:, :2] += self.correction * crop_size
+        return mapped
+
+    def map_crop(self, landmarks: np.ndarray, crop: FaceCrop, image_width: int) -> np.ndarray:
+        """Map landmarks on the camera image to the face cropped by crop_face.
+
+        Args:
+            landmarks (np.ndarray): landmarks on the camera image (N x 3)
+            crop (FaceCrop): face cropped by crop_face
+            image_width (int): width of the camera image
+
+        Returns:
+            np.ndarray: landmarks on crop.resized (N x 3)
+        """
+        return self.map(landmarks, crop.offset, crop.resize_factor, crop.crop_size, image_width)
+
+    def needs_refinement(self) -> bool:
+        """Whether to run the second inference for the current frame.
+
+        Returns:
+            bool: True if the landmarks should be refined
+        """
+        return self.refine_interval is not None and (self.frame_count - 1) % self.refine_interval == 0
+
+    def refine(self, mapped: np.ndarray, landmarks: np.ndarray, crop_size: tuple[int, int]) -> None:
+        """2回目の推論の結果から補正量を更新する.
+
+        Args:
+            mapped (np.ndarray): landmarks returned by map (N x 3)
+            landmarks (np.ndarray): landmarks inferred on the resized crop (N x 3)
+            crop_size (tuple[int, int]): (width, height) of the resized crop
+        """
+        if self.correction is None or self.correction.shape[0] != mapped.shape[0]:
+            self.correction = np.zeros((mapped.shape[0], 2), np.float32)
+        residual = (landmarks[:, :2] - mapped[:, :2]) / crop_size
+        self.correction += self.REFINE_WEIGHT * residual
@@ -1,8 +1,45 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, auto
+from itertools import combinations
 from typing import Final, Tuple
 
 import cv2
 import numpy as np
 
+from .bufferpool import BufferPool
+from .temporal import TemporalReuse
+from .triangulation import get_mesh, load_points, rasterize_triangles, select_coarse_points
+
+
+class WarpEngine(Enum):
+    TRIANGLE = auto()  # 三角形ごとにwarpAffineする
+    REMAP = auto()  # 三角形IDマップからremapテーブルを作り、1回のremapでwarpする
+    PARALLEL = auto()  # TRIANGLEを出力の帯ごとに分割し、スレッドプールで並列にwarpする
+
+
+_executors: dict[int, ThreadPoolExecutor] = {}  # ワーカー数ごとにプロセス全体で共有するスレッドプール
+
+
+def _get_executor(workers: int) -> ThreadPoolExecutor:
+    """Get the thread pool shared by all Effect instances.
+
+    Args:
+        workers (int): number of worker threads
+
+    Returns:
+        ThreadPoolExecutor: thread pool
+    """
+    if workers not in _executors:
+        _executors[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="effect")
+    return _executors[workers]
+
+
+class LevelOfDetail(Enum):
+    COARSE = auto()  # filter_pointsから間引いたランドマーク
+    MEDIUM = auto()  # filter_points
+    FULL = auto()  # 全てのランドマーク
+
 
 class Effect:
     EFFECT_IMAGE_WIDTH: Final = 1024
@@ -10,40 +47,101 @@ class Effect:
     SRC_POINTS_PATH: Final = "imake/res/source_landmarks.npy"
     FILTER_POINTS_PATH: Final = "imake/res/filter_points.npy"
 
+    MIN_TRIANGLE_AREA: Final = 1.0  # これより(符号付き面積の2倍が)小さい三角形は潰れているとみなす
+    OCCUPANCY_MARGIN: Final = 4  # 三角形の外側でもwarpAffineの補間で参照されうる画素の幅
+    MIPMAP_LEVELS: Final = 4  # effect_pyramidの段数 (1024, 512, 256, 128)
+
+    COARSE_POINTS_RATIO: Final = 0.5  # LevelOfDetail.COARSEで使うfilter_pointsの割合
+    # 出力画像上の顔の幅(px)がこれ以上ならそのLevelOfDetailを使う (どれにも当てはまらなければCOARSE)
+    LOD_MIN_FACE_WIDTHS: Final = ((LevelOfDetail.FULL, 480), (LevelOfDetail.MEDIUM, 240))
+
     def __init__(
         self,
         effect_image: np.ndarray | None = None,
         use_filter_points: bool = True,
+        warp_engine: WarpEngine = WarpEngine.TRIANGLE,
+        render_workers: int | None = None,
+        cull_triangles: bool = False,
+        adaptive_lod: bool = False,
+        reuse_threshold: float | None = None,
+        rigid_reuse_threshold: float | None = None,
+        use_mipmap: bool = False,
+        buffer_pool: BufferPool | None = None,
     ):
         """Initialize Effect.
 
         Args:
             effect_image (np.ndarray): effect image (1024 x 1024)
             use_filter_points (bool, optional): use filter landmarks. Defaults to True. (If False, use all landmarks)
+            warp_engine (WarpEngine, optional): engine used by create_effect. Defaults to WarpEngine.TRIANGLE.
+            render_workers (int | None, optional): number of threads for WarpEngine.PARALLEL. Defaults to None.
+                (If None, use the number of CPUs)
+            cull_triangles (bool, optional): drop back-facing or degenerate triangles. Defaults to False.
+            adaptive_lod (bool, optional): choose the mesh from the face size every frame. Defaults to False.
+                (If True, use_filter_points is ignored)
+            reuse_threshold (float | None, optional): reuse the last overlay while every landmark moves less than
+                this (px). Defaults to None. (If None, always create the overlay)
+            rigid_reuse_threshold (float | None, optional): apply a similarity transform to the last overlay while
+                the landmarks move rigidly within this error (px). Defaults to None. (Used with reuse_threshold)
+            use_mipmap (bool, optional): sample the effect image from a pre-filtered pyramid level that fits the
+                face scale. Defaults to False.
+            buffer_pool (BufferPool | None, optional): pool to get overlays and work buffers from. Defaults to None.
+                (If None, allocate them every frame)
         """
+        self.src_points = load_points(self.SRC_POINTS_PATH)  # facemeshが返却する468(467)個のランドマークの座標
+        self.filter_points = load_points(self.FILTER_POINTS_PATH)  # src_pointsの中から選択するランドマークのindex
+
+        self.warp_engine = warp_engine
+        self.render_workers = render_workers or os.cpu_count() or 1
+        self.cull_triangles = cull_triangles
+        self.culled_triangles_count = 0  # 直前のcreate_effectで取り除いた三角形の数
+
+        self.use_filter_points = use_filter_points
+        self.adaptive_lod = adaptive_lod
+        self.level_of_detail = LevelOfDetail.MEDIUM if use_filter_points else LevelOfDetail.FULL  # 直前に使ったもの
+        # create_effectの結果を出力画像にするときの拡大率. 顔を切り取って描画してから縮小する場合は、呼び出し側で設定する
+        self.output_scale = 1.0
+        # 三角形分割はプロセス内・ディスクにキャッシュされる
+        self.meshes = {
+            lod: get_mesh(
+                self.src_points, self._get_lod_point_indices(lod), self.EFFECT_IMAGE_WIDTH, self.EFFECT_IMAGE_HEIGHT
+            )
+            for lod in (LevelOfDetail if adaptive_lod else [self.level_of_detail])
+        }
+        # effect_imageに描画される部分がある三角形
+        self.active_triangles = {lod: mesh.triangles for lod, mesh in self.meshes.items()}
+
+        self.use_mipmap = use_mipmap
+        # effect_pyramidの各段でのsrc_points (段が下がるごとに1/2. pyrDownの画素の中心がずれないように0.5ずらす)
+        self.src_points_pyramid = [self.src_points] + [
+            ((self.src_points + 0.5) / 2**level - 0.5).astype(np.float32) for level in range(1, self.MIPMAP_LEVELS)
+        ]
+        self.effect_pyramid: list[np.ndarray] = []
+
+        self.buffer_pool = buffer_pool
+        self.temporal_reuse = (
+            TemporalReuse(reuse_threshold, rigid_reuse_threshold) if reuse_threshold is not None else None
+        )
+
         if effect_image is not None:
             self.set_effect_image(effect_image)
 
-        self.src_points = np.load(self.SRC_POINTS_PATH)  # facemeshが返却する468(467)個のランドマークの座標
-        self.filter_points = np.load(self.FILTER_POINTS_PATH)  # src_pointsの中から選択するランドマークのindex
+    def _get_lod_point_indices(self, lod: LevelOfDetail) -> np.ndarray | None:
+        """Get indices of the landmarks used for the level of detail.
 
-        self.use_filter_points = use_filter_points
-        if use_filter_points:
-            self.src_points = self.src_points[self.filter_points]
-
-        self.subdiv = cv2.Subdiv2D(
-            (0, 0, self.EFFECT_IMAGE_WIDTH, self.EFFECT_IMAGE_HEIGHT)
-        )  # cv2.Subdiv2D((left, top, right, bottom))
-        self.subdiv.insert(self.src_points.tolist())  # 対象の点を追加
-
-        self.triangles_1D = np.array(
-            [
-                (self.src_points == value).all(axis=1).nonzero()
-                for element in self.subdiv.getTriangleList()  # ドロネー三角形を取得 element=[1個目のx座標 1個目のy座標 2個目のx座標 2個目のy座標 3個目のx座標 3個目のy座標]
-                for value in element.reshape((3, 2))
-            ]
+        Args:
+            lod (LevelOfDetail): level of detail
+
+        Returns:
+            np.ndarray | None: indices of the landmarks (None means all landmarks)
+        """
+        if lod == LevelOfDetail.FULL:
+            return None
+        if lod == LevelOfDetail.MEDIUM:
+            return self.filter_points
+        return select_coarse_points(
+            self.src_points, self.filter_points, int(len(self.filter_points) * self.COARSE_POINTS_RATIO)
         )
-        self.triangles = self.triangles_1D.reshape(len(self.triangles_1D) // 3, 3)
 
     def set_effect_image(self, effect_image: np.ndarray) -> None:
         """Set effect image.
@@ -56,6 +154,53 @@ class Effect:
         ):
             raise ValueError("Effect image size must be 1024x1024")
         self.effect_image = effect_image
+        self.effect_pyramid = [effect_image]
+        if self.use_mipmap:
+            self._build_effect_pyramid(effect_image)
+        if self.temporal_reuse is not None:
+            self.temporal_reuse.reset()
+
+        occupied = self._get_occupied_pixels(effect_image)
+        for lod, mesh in self.meshes.items():
+            if occupied is None:
+                self.active_triangles[lod] = mesh.triangles
+                continue
+            triangle_ids = mesh.triangle_id_map[occupied]
+            # NO_TRIANGLE_IDを除いて、描画される画素を含む三角形を選ぶ
+            is_active = np.bincount(triangle_ids + 1, minlength=len(mesh.triangles) + 1)[1:] > 0
+            self.active_triangles[lod] = mesh.triangles[is_active]
+
+    def _build_effect_pyramid(self, effect_image: np.ndarray) -> None:
+        """effect_pyramidの2段目以降を作る.
+
+        透明な画素のBGRが縁に混ざらないように、アルファを掛けてから縮小し、各段でアルファを割り戻す.
+
+        Args:
+            effect_image (np.ndarray): effect image (1024 x 1024)
+        """
+        has_alpha = effect_image.ndim == 3 and effect_image.shape[2] == 4
+        image = cv2.cvtColor(effect_image, cv2.COLOR_RGBA2mRGBA) if has_alpha else effect_image
+        for _ in range(1, self.MIPMAP_LEVELS):
+            image = cv2.pyrDown(image)
+            self.effect_pyramid.append(cv2.cvtColor(image, cv2.COLOR_mRGBA2RGBA) if has_alpha else image)
+
+    def _get_occupied_pixels(self, effect_image: np.ndarray) -> np.ndarray | None:
+        """アルファ値が0でない画素(とwarpAffineの補間で参照されうる周囲の画素)を調べる.
+
+        Args:
+            effect_image (np.ndarray): effect image (1024 x 1024)
+
+        Returns:
+            np.ndarray | None: occupied mask (None if the image has no alpha channel)
+        """
+        if effect_image.ndim != 3 or effect_image.shape[2] != 4:
+            return None
+
+        occupied = cv2.dilate(
+            (effect_image[:, :, 3] > 0).astype(np.uint8),
+            np.ones((2 * self.OCCUPANCY_MARGIN + 1, 2 * self.OCCUPANCY_MARGIN + 1), np.uint8),
+        )
+        return occupied > 0
 
     def create_effect(self, target_image: np.ndarray, target_landmarks: np.ndarray) -> np.ndarray:
         """Creates effect image that can be rendered into an image the size of
@@ -64,27 +209,305 @@ class Effect:
         Args:
             target_image (np.ndarray): target image
             target_landmarks (np.ndarray): landmarks on the target image. Must be the same size as the source landmarks.
+                (faces x landmarks x 3 to render multiple faces into one effect image)
 
         Returns:
             np.ndarray: effect image (BGRA)
         """
         if self.effect_image is None:
             raise ValueError("Effect image is not set")
+        self.culled_triangles_count = 0  # 前のフレームの値を残さない (前のoverlayを使い回すフレームでは描画しない)
+
+        # 複数の顔のランドマークは1つの配列にまとめ、三角形のindexをずらして1回で描画する
+        num_faces = target_landmarks.shape[0] if target_landmarks.ndim == 3 else 1
+        num_landmarks = target_landmarks.shape[-2]  # 1つの顔のランドマークの数 (refine_landmarksでは虹彩の分も含む478)
+        target_landmarks = target_landmarks.reshape(-1, target_landmarks.shape[-1])
+
+        if self.temporal_reuse is None:
+            return self._create_overlay(target_image, target_landmarks, num_faces, num_landmarks)
+
+        overlay = self.temporal_reuse.get(target_image.shape, target_landmarks)
+        if overlay is None:
+            overlay = self._create_overlay(target_image, target_landmarks, num_faces, num_landmarks)
+            self.temporal_reuse.update(target_landmarks, overlay)
+        return overlay
+
+    def shares_cached_overlay(self, image: np.ndarray) -> bool:
+        """Whether the image may be (a view of) the overlay kept for temporal reuse.
+
+        使い回すoverlayに書き込むと、次のフレームにも残るので、書き込む前にコピーする.
+
+        Args:
+            image (np.ndarray): image returned by create_effect or derived from it
+
+        Returns:
+            bool: True if the image may share memory with the cached overlay
+        """
+        if self.temporal_reuse is None or self.temporal_reuse.ref_overlay is None:
+            return False
+        return np.may_share_memory(image, self.temporal_reuse.ref_overlay)
+
+    def _create_overlay(
+        self, target_image: np.ndarray, target_landmarks: np.ndarray, num_faces: int, num_landmarks: int
+    ) -> np.ndarray:
+        """Warp the effect image to the target landmarks.
+
+        Args:
+            target_image (np.ndarray): target image
+            target_landmarks (np.ndarray): landmarks on the target image ((faces x landmarks) x 3)
+            num_faces (int): number of faces in target_landmarks
+            num_landmarks (int): number of landmarks of a face in target_landmarks
+
+        Returns:
+            np.ndarray: effect image (BGRA)
+        """
+        if self.adaptive_lod:
+            self.level_of_detail = self._select_level_of_detail(target_landmarks, num_faces)
+        triangles = self._stack_faces(self.active_triangles[self.level_of_detail], num_faces, num_landmarks)
+        active_triangles_count = len(triangles)
+        if self.cull_triangles:
+            triangles = self._cull_triangles(triangles, target_landmarks, num_landmarks)
+        self.culled_triangles_count = active_triangles_count - len(triangles)
+
+        level = self._select_mipmap_level(target_landmarks, triangles, num_landmarks) if self.use_mipmap else 0
+        src_image, src_points = self.effect_pyramid[level], self.src_points_pyramid[level]
+        if num_faces > 1:
+            src_points = self._stack_src_points(src_points, num_faces, num_landmarks)
+
+        height, width = target_image.shape[:2]
+        if self.warp_engine == WarpEngine.REMAP:
+            return self._warp_by_remap(
+                height, width, target_landmarks, triangles, src_image, src_points, num_landmarks
+            )
+        if self.warp_engine == WarpEngine.PARALLEL:
+            return self._warp_by_parallel(height, width, target_landmarks, triangles, src_image, src_points)
+        return self._warp_by_triangle(height, width, target_landmarks, triangles, src_image, src_points)
+
+    def _stack_faces(self, triangles: np.ndarray, num_faces: int, num_landmarks: int) -> np.ndarray:
+        """顔ごとにランドマークのindexをずらした三角形を並べる.
+
+        Args:
+            triangles (np.ndarray): triangles of a face (T x 3)
+            num_faces (int): number of faces
+            num_landmarks (int): number of landmarks of a face (indexをずらす幅)
+
+        Returns:
+            np.ndarray: triangles of all faces ((faces x T) x 3)
+        """
+        if num_faces == 1:
+            return triangles
+        offsets = num_landmarks * np.arange(num_faces)
+        return (triangles[np.newaxis] + offsets[:, np.newaxis, np.newaxis]).reshape(-1, 3)
+
+    @staticmethod
+    def _stack_src_points(src_points: np.ndarray, num_faces: int, num_landmarks: int) -> np.ndarray:
+        """_stack_facesでずらした三角形のindexで引けるように、src_pointsを顔の数だけ並べる.
+
+        Args:
+            src_points (np.ndarray): source landmarks (N x 2)
+            num_faces (int): number of faces
+            num_landmarks (int): number of landmarks of a face (N以上. N以降の虹彩の分は三角形に含まれない)
+
+        Returns:
+            np.ndarray: source landmarks of all faces ((faces x num_landmarks) x 2)
+        """
+        stacked = np.zeros((num_faces, num_landmarks, src_points.shape[1]), src_points.dtype)
+        stacked[:, : len(src_points)] = src_points
+        return stacked.reshape(-1, src_points.shape[1])
+
+    def _select_mipmap_level(self, target_landmarks: np.ndarray, triangles: np.ndarray, num_landmarks: int) -> int:
+        """顔全体の縮小率から、effect_pyramidのどの段を使うかを選ぶ.
+
+        Args:
+            target_landmarks (np.ndarray): landmarks on the target image
+            triangles (np.ndarray): triangles to draw (T x 3)
+            num_landmarks (int): number of landmarks of a face
+
+        Returns:
+            int: level of effect_pyramid (0 is the original size)
+        """
+        src_tris = self.src_points[triangles % num_landmarks]
+        src_area = np.abs(self._get_signed_areas(src_tris.astype(np.float64))).sum()
+        dst_area = np.abs(self._get_signed_areas(target_landmarks[triangles][:, :, :2].astype(np.float64))).sum()
+        if src_area == 0 or dst_area == 0:
+            return 0
+        scale = np.sqrt(dst_area / src_area)  # 出力1pxあたりのエフェクト画像の画素数の逆数
+        return int(np.clip(np.floor(np.log2(1.0 / scale)), 0, len(self.effect_pyramid) - 1))
+
+    def _select_level_of_detail(self, target_landmarks: np.ndarray, num_faces: int) -> LevelOfDetail:
+        """出力画像上の顔の大きさ(ランドマークの外接矩形の幅×output_scale)からLevelOfDetailを選ぶ.
+
+        複数の顔では最も大きい顔に合わせる.
+
+        Args:
+            target_landmarks (np.ndarray): landmarks on the target image
+            num_faces (int): number of faces in target_landmarks
+
+        Returns:
+            LevelOfDetail: level of detail
+        """
+        face_width = np.ptp(target_landmarks[:, 0].reshape(num_faces, -1), axis=1).max() * self.output_scale
+        for lod, min_face_width in self.LOD_MIN_FACE_WIDTHS:
+            if face_width >= min_face_width:
+                return lod
+        return LevelOfDetail.COARSE
+
+    def _cull_triangles(self, triangles: np.ndarray, target_landmarks: np.ndarray, num_landmarks: int) -> np.ndarray:
+        """裏返った三角形(顔を横に向けたときに折り返された部分)と、潰れた三角形を取り除く.
 
-        if self.use_filter_points:
-            target_landmarks = target_landmarks[self.filter_points]
+        巻き方向がエフェクト画像上と逆になった三角形を裏向きとみなす. ただし全体が反転(鏡像)している場合は
+        多数派の巻き方向を表とする. 残った三角形はzが小さい(カメラに近い)順に並べ替え、重なった画素では
+        手前の三角形が優先されるようにする.
 
+        Args:
+            triangles (np.ndarray): triangles to draw (T x 3)
+            target_landmarks (np.ndarray): landmarks on the target image
+            num_landmarks (int): number of landmarks of a face
+
+        Returns:
+            np.ndarray: triangles to draw (nearest first)
+        """
+        src_area = self._get_signed_areas(self.src_points[triangles % num_landmarks].astype(np.float64))
+        dst_area = self._get_signed_areas(target_landmarks[triangles][:, :, :2].astype(np.float64))
+        relative_area = np.sign(src_area) * dst_area  # エフェクト画像上と同じ巻き方向なら正
+        front = 1.0 if relative_area.sum() >= 0 else -1.0
+
+        visible = (relative_area * front > 0) & (np.abs(dst_area) >= self.MIN_TRIANGLE_AREA)
+        triangles = triangles[visible]
+        if target_landmarks.shape[1] > 2:
+            depth = target_landmarks[triangles][:, :, 2].mean(axis=1)
+            triangles = triangles[np.argsort(depth, kind="stable")]
+        return triangles
+
+    @staticmethod
+    def _get_signed_areas(tris: np.ndarray) -> np.ndarray:
+        """三角形の符号付き面積(の2倍)を計算する. 符号は巻き方向を表す.
+
+        Args:
+            tris (np.ndarray): triangles (T x 3 x 2)
+
+        Returns:
+            np.ndarray: signed areas (T)
+        """
+        edge1 = tris[:, 1] - tris[:, 0]
+        edge2 = tris[:, 2] - tris[:, 0]
+        return edge1[:, 0] * edge2[:, 1] - edge1[:, 1] * edge2[:, 0]
+
+    def _warp_by_triangle(
+        self,
+        height: int,
+        width: int,
+        target_landmarks: np.ndarray,
+        triangles: np.ndarray,
+        src_image: np.ndarray,
+        src_points: np.ndarray,
+    ) -> np.ndarray:
+        """三角形ごとにアフィン変換してエフェクト画像を作成する.
+
+        Args:
+            height (int): height of the target image
+            width (int): width of the target image
+            target_landmarks (np.ndarray): landmarks on the target image
+            triangles (np.ndarray): triangles to draw (T x 3)
+            src_image (np.ndarray): effect image to sample (BGRA)
+            src_points (np.ndarray): source landmarks on src_image (N x 2)
+
+        Returns:
+            np.ndarray: effect image (BGRA)
+        """
         # create empty overlay
-        overlay = np.zeros((target_image.shape[0], target_image.shape[1], 4), np.uint8)
+        overlay = self._zeros((height, width, 4))
+        self._warp_triangles(
+            overlay, target_landmarks[:, :2].astype(np.int32), triangles, src_image, src_points, 0, height
+        )
+        return overlay
+
+    def _warp_by_parallel(
+        self,
+        height: int,
+        width: int,
+        target_landmarks: np.ndarray,
+        triangles: np.ndarray,
+        src_image: np.ndarray,
+        src_points: np.ndarray,
+    ) -> np.ndarray:
+        """出力を横長の帯(タイル)に分割し、帯ごとに_warp_trianglesをスレッドプールで並列実行する.
 
-        for idx_tri in self.triangles:
-            src_tri = self.src_points[idx_tri]
-            dst_tri_full = target_landmarks[idx_tri]
-            dst_tri = dst_tri_full[:, :2].astype(np.int32)
+        各帯は重ならない行だけに書き込み、帯の中では_warp_by_triangleと同じ順番で三角形を描画するので、
+        「先に描画した三角形を優先する」規則が保たれ、結果は_warp_by_triangleと一致する.
 
-            src_tri_crop, src_crop = self._crop_triangle_bb(self.effect_image, src_tri)
+        Args:
+            height (int): height of the target image
+            width (int): width of the target image
+            target_landmarks (np.ndarray): landmarks on the target image
+            triangles (np.ndarray): triangles to draw (T x 3)
+            src_image (np.ndarray): effect image to sample (BGRA)
+            src_points (np.ndarray): source landmarks on src_image (N x 2)
+
+        Returns:
+            np.ndarray: effect image (BGRA)
+        """
+        overlay = self._zeros((height, width, 4))
+        dst_points = target_landmarks[:, :2].astype(np.int32)
+
+        # 各三角形が書き込む行の範囲 (_crop_triangle_bbと同じく画像の範囲内に収める)
+        tri_y = dst_points[triangles][:, :, 1]
+        tri_top = np.clip(tri_y.min(axis=1), 0, height)
+        tri_bottom = np.clip(tri_y.max(axis=1) + 1, 0, height)
+
+        bounds = np.linspace(0, height, self.render_workers + 1).astype(int)
+        futures = []
+        for top, bottom in zip(bounds[:-1], bounds[1:]):
+            band_triangles = triangles[(tri_top < bottom) & (tri_bottom > top)]
+            if len(band_triangles) == 0:
+                continue
+            futures.append(
+                _get_executor(self.render_workers).submit(
+                    self._warp_triangles, overlay, dst_points, band_triangles, src_image, src_points, top, bottom
+                )
+            )
+        for future in futures:
+            future.result()
+        return overlay
+
+    def _warp_triangles(
+        self,
+        overlay: np.ndarray,
+        dst_points: np.ndarray,
+        triangles: np.ndarray,
+        src_image: np.ndarray,
+        src_points: np.ndarray,
+        top: int,
+        bottom: int,
+    ) -> None:
+        """trianglesを順番にアフィン変換し、overlayのtop行目からbottom行目(含まない)までに描画する.
+
+        Args:
+            overlay (np.ndarray): overlay to draw (BGRA)
+            dst_points (np.ndarray): landmarks on the target image (int32, N x 2)
+            triangles (np.ndarray): triangles to draw (T x 3)
+            src_image (np.ndarray): effect image to sample (BGRA)
+            src_points (np.ndarray): source landmarks on src_image (N x 2)
+            top (int): first row to draw
+            bottom (int): last row to draw (exclusive)
+        """
+        # 三角形ごとのマスクは、overlayと同じ大きさの作業用バッファの左上を使い回す
+        mask_buffer = self._empty(overlay.shape)
+        for idx_tri in triangles:
+            src_tri = src_points[idx_tri]
+            dst_tri = dst_points[idx_tri]
+
+            src_tri_crop, src_crop = self._crop_triangle_bb(src_image, src_tri)
             dst_tri_crop, overlay_crop = self._crop_triangle_bb(overlay, dst_tri)
 
+            # overlay_cropのうち、描画する行の範囲
+            crop_top = min(max(int(dst_tri[:, 1].min()), 0), overlay.shape[0])
+            row_start = max(top - crop_top, 0)
+            row_stop = min(bottom - crop_top, overlay_crop.shape[0])
+            # 画像の外にある三角形は描画しない (shapeが一つでも0になるとエラーになる)
+            if row_start >= row_stop or overlay_crop.shape[1] == 0:
+                continue
+
             warp_mat = cv2.getAffineTransform(np.float32(src_tri_crop), np.float32(dst_tri_crop))  # アフィン変換の変換行列を取得
             warp = cv2.warpAffine(
                 src_crop,
@@ -95,21 +518,192 @@ class Effect:
                 borderMode=cv2.BORDER_REFLECT_101,
             )
 
-            mask = np.zeros((overlay_crop.shape[0], overlay_crop.shape[1], 4), dtype=np.uint8)  # shapeが一つでも0になるとエラーになる
-            if mask.shape[0] != 0 and mask.shape[1] != 0:
-                cv2.fillConvexPoly(
-                    mask, np.int32(dst_tri_crop), (1.0, 1.0, 1.0, 1.0), 16, 0
-                )  # 多角形を描画 fillConvexPoly(元の画像, 複数の座標, color, ...)
-                mask[np.where(overlay_crop > 0)] = 0
+            mask = mask_buffer[: overlay_crop.shape[0], : overlay_crop.shape[1]]
+            mask.fill(0)
+            cv2.fillConvexPoly(
+                mask, np.int32(dst_tri_crop), (1.0, 1.0, 1.0, 1.0), 16, 0
+            )  # 多角形を描画 fillConvexPoly(元の画像, 複数の座標, color, ...)
+            mask = mask[row_start:row_stop]
+            overlay_crop = overlay_crop[row_start:row_stop]
+            mask[overlay_crop > 0] = 0
+
+            cropped_triangle = np.multiply(warp[row_start:row_stop], mask, out=mask)
+            overlay_crop += cropped_triangle
 
-                cropped_triangle = warp * mask
-                overlay_crop += cropped_triangle
+    def _zeros(self, shape: tuple[int, ...]) -> np.ndarray:
+        """Get a zero-filled uint8 buffer from buffer_pool if set.
+
+        Args:
+            shape (tuple[int, ...]): shape
+
+        Returns:
+            np.ndarray: buffer
+        """
+        if self.buffer_pool is None:
+            return np.zeros(shape, np.uint8)
+        return self.buffer_pool.zeros(shape)
 
+    def _empty(self, shape: tuple[int, ...]) -> np.ndarray:
+        """Get an uninitialized uint8 buffer from buffer_pool if set.
+
+        Args:
+            shape (tuple[int, ...]): shape
+
+        Returns:
+            np.ndarray: buffer
+        """
+        if self.buffer_pool is None:
+            return np.empty(shape, np.uint8)
+        return self.buffer_pool.empty(shape)
+
+    def _warp_by_remap(
+        self,
+        height: int,
+        width: int,
+        target_landmarks: np.ndarray,
+        triangles: np.ndarray,
+        src_image: np.ndarray,
+        src_points: np.ndarray,
+        num_landmarks: int,
+    ) -> np.ndarray:
+        """三角形IDマップとremapテーブルを作り、remapでエフェクト画像を作成する.
+
+        出力の各画素がどの三角形に属するかを1枚のマップに描画し、全三角形の(出力→エフェクト画像の)アフィン変換行列を
+        まとめて計算してremapテーブルを作る. 重なった画素は_warp_by_triangleと同じく先に描画する三角形を優先する.
+        複数の顔は、外接矩形が重なる顔のまとまりごとにテーブルを作る. (顔の間の空いた範囲のテーブルを作らない)
+
+        Args:
+            height (int): height of the target image
+            width (int): width of the target image
+            target_landmarks (np.ndarray): landmarks on the target image
+            triangles (np.ndarray): triangles to draw (T x 3)
+            src_image (np.ndarray): effect image to sample (BGRA)
+            src_points (np.ndarray): source landmarks on src_image (N x 2)
+            num_landmarks (int): number of landmarks of a face (三角形がどの顔のものかを求める)
+
+        Returns:
+            np.ndarray: effect image (BGRA)
+        """
+        overlay = self._zeros((height, width, 4))
+        dst_points = target_landmarks[:, :2].astype(np.int32)
+        for group in self._group_faces(dst_points, triangles, num_landmarks):
+            self._remap_triangles(overlay, dst_points[triangles[group]], src_points[triangles[group]], src_image)
         return overlay
 
+    @staticmethod
+    def _group_faces(dst_points: np.ndarray, triangles: np.ndarray, num_landmarks: int) -> list[np.ndarray]:
+        """三角形を、外接矩形が重なる顔のまとまりに分ける. (まとまりの中では三角形の順番を保つ)
+
+        Args:
+            dst_points (np.ndarray): landmarks on the target image (int32, N x 2)
+            triangles (np.ndarray): triangles to draw (T x 3)
+            num_landmarks (int): number of landmarks of a face
+
+        Returns:
+            list[np.ndarray]: masks of the triangles of each group (T)
+        """
+        face_ids = triangles[:, 0] // num_landmarks
+        faces = np.unique(face_ids)
+        if len(faces) <= 1:
+            return [np.ones(len(triangles), bool)] if len(triangles) > 0 else []
+
+        # (顔のリスト, 外接矩形の左上・右下)
+        groups = []
+        for face in faces:
+            points = dst_points[triangles[face_ids == face]].reshape(-1, 2)
+            groups.append(([face], points.min(axis=0), points.max(axis=0)))
+        merged = True
+        while merged:
+            merged = False
+            for i, j in combinations(range(len(groups)), 2):
+                (faces_i, min_i, max_i), (faces_j, min_j, max_j) = groups[i], groups[j]
+                if np.all(min_i <= max_j) and np.all(min_j <= max_i):
+                    groups[i] = (faces_i + faces_j, np.minimum(min_i, min_j), np.maximum(max_i, max_j))
+                    del groups[j]
+                    merged = True
+                    break
+        return [np.isin(face_ids, group_faces) for group_faces, _, _ in groups]
+
+    def _remap_triangles(
+        self, overlay: np.ndarray, dst_tris: np.ndarray, src_tris: np.ndarray, src_image: np.ndarray
+    ) -> None:
+        """三角形の外接矩形の範囲のremapテーブルを作り、overlayに1回のremapで描画する.
+
+        Args:
+            overlay (np.ndarray): overlay to draw (BGRA)
+            dst_tris (np.ndarray): triangles on the target image (int32, T x 3 x 2)
+            src_tris (np.ndarray): triangles on src_image (T x 3 x 2)
+            src_image (np.ndarray): effect image to sample (BGRA)
+        """
+        height, width = overlay.shape[:2]
+        x, y, w, h = self._clip_rect(cv2.boundingRect(dst_tris.reshape(-1, 2)), width, height)
+        if w == 0 or h == 0:
+            return
+
+        dst_tris = dst_tris - np.array([x, y], dtype=np.int32)
+
+        triangle_id_map = rasterize_triangles(dst_tris, w, h)
+
+        inv_mats, valid = self._get_affine_matrices(dst_tris, src_tris)
+        # どの三角形にも含まれない画素・面積0の三角形の画素は、範囲外(-1, -1)を参照させて透明にする
+        inv_mats = np.concatenate([inv_mats.reshape(-1, 6), [[0, 0, -1, 0, 0, -1]]]).astype(np.float32)
+        inv_mats[np.append(~valid, False)] = inv_mats[-1]
+        mats = inv_mats[triangle_id_map]  # NO_TRIANGLE_ID(-1)は最後の行を参照する
+
+        grid_x = np.arange(w, dtype=np.float32)[np.newaxis, :]
+        grid_y = np.arange(h, dtype=np.float32)[:, np.newaxis]
+        map_x = mats[:, :, 0] * grid_x + mats[:, :, 1] * grid_y + mats[:, :, 2]
+        map_y = mats[:, :, 3] * grid_x + mats[:, :, 4] * grid_y + mats[:, :, 5]
+
+        cv2.remap(
+            src_image,
+            map_x,
+            map_y,
+            cv2.INTER_LINEAR,
+            dst=overlay[y : y + h, x : x + w],
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0, 0),
+        )
+
+    @staticmethod
+    def _get_affine_matrices(src_tris: np.ndarray, dst_tris: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """全三角形のアフィン変換行列(src→dst)をまとめて計算する.
+
+        Args:
+            src_tris (np.ndarray): source triangles (N x 3 x 2)
+            dst_tris (np.ndarray): destination triangles (N x 3 x 2)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: affine matrices (N x 2 x 3), valid flags (N) (Falseは面積0の三角形)
+        """
+        src = np.concatenate([src_tris.astype(np.float64), np.ones((len(src_tris), 3, 1))], axis=2)  # (N, 3, 3)
+        valid = np.abs(np.linalg.det(src)) > 1e-6
+        src[~valid] = np.eye(3)  # 特異行列はsolveできないので単位行列に置き換える
+        mats = np.linalg.solve(src, dst_tris.astype(np.float64)).transpose(0, 2, 1)  # src @ M.T = dst
+        return mats, valid
+
+    @staticmethod
+    def _clip_rect(rect: Tuple[int, int, int, int], width: int, height: int) -> Tuple[int, int, int, int]:
+        """矩形を画像の範囲内に収める.
+
+        Args:
+            rect (Tuple[int, int, int, int]): x, y, w, h
+            width (int): image width
+            height (int): image height
+
+        Returns:
+            Tuple[int, int, int, int]: clipped x, y, w, h
+        """
+        x, y, w, h = rect
+        left, top = min(max(x, 0), width), min(max(y, 0), height)
+        right, bottom = min(max(x + w, 0), width), min(max(y + h, 0), height)
+        return left, top, right - left, bottom - top
+
     def _crop_triangle_bb(self, image: np.ndarray, triangle: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """Create a triangle bounding box and return cropped image.
 
+        外接矩形は画像の範囲内に収める. (画像の外にはみ出した部分は、切り取った画像の外の座標になる)
+
         Args:
             image (np.ndarray): target image
             triangle (np.ndarray): Triangle coordinates (3x2 array)
@@ -117,7 +711,7 @@ class Effect:
         Returns:
             _type_: Tupple (Triangle crop coordinates relative to the cropped image, cropped image)
         """
-        x, y, w, h = cv2.boundingRect(triangle)  # 外接矩形(回転なし)
+        x, y, w, h = self._clip_rect(cv2.boundingRect(triangle), image.shape[1], image.shape[0])  # 外接矩形(回転なし)
         crop = image[y : y + h, x : x + w]
         triangle_crop = triangle - np.array([x, y])
         return triangle_crop, crop
@@ -0,0 +1,216 @@
+import threading
+import time
+from typing import Any, Final
+
+import cv2
+import numpy as np
+
+# OpenCV 4.5.5より前はクロマサブサンプリングを指定できないので、その場合はデフォルト(4:2:0)のままにする
+_SAMPLING_FACTOR: Final = getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR", None)
+_SAMPLING_FACTOR_420: Final = getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None)
+_SAMPLING_FACTOR_444: Final = getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None)
+
+
+class AdaptiveJpegEncoder:
+    """JPEGの品質とクロマサブサンプリングを、エンコード時間の予算・目標ビットレートに合わせて変えるエンコーダー.
+
+    品質はmin_qualityからmax_qualityまでのレベルで表し、最も高いレベルだけ4:4:4、それ以外は4:2:0でエンコードする.
+    submitしたフレームは専用のスレッドでエンコードし、まだエンコードしていないフレームは新しいフレームで上書きする.
+    """
+
+    QUALITY_STEP: Final = 5
+    HEADROOM: Final = 0.8  # 予算・目標のこの割合より小さければ品質を上げる
+    SMOOTHING: Final = 0.2  # 指標の指数移動平均の重み
+    WAIT_TIMEOUT: Final = 0.1  # stopを確認する間隔(秒)
+
+    def __init__(
+        self,
+        max_quality: int = 95,
+        min_quality: int = 50,
+        budget_ms: float | None = None,
+        target_bitrate: float | None = None,
+    ):
+        """Initialize AdaptiveJpegEncoder.
+
+        Args:
+            max_quality (int, optional): highest JPEG quality. Defaults to 95. (cv2.imencodeのデフォルト)
+            min_quality (int, optional): lowest JPEG quality. Defaults to 50.
+            budget_ms (float | None, optional): target encode time per frame (ms). Defaults to None.
+            target_bitrate (float | None, optional): target bitrate (bytes/s). Defaults to None.
+                (If both are None, always encode at max_quality with 4:2:0)
+        """
+        self.levels: list[tuple[int, int | None]] = [
+            (quality, _SAMPLING_FACTOR_420) for quality in range(min_quality, max_quality, self.QUALITY_STEP)
+        ] + [(max_quality, _SAMPLING_FACTOR_420)]
+        if _SAMPLING_FACTOR_444 is not None and (budget_ms is not None or target_bitrate is not None):
+            self.levels.append((max_quality, _SAMPLING_FACTOR_444))
+        self.level = len(self.levels) - 1  # 最も高いレベルから始めて、予算・目標を超えたら下げる
+        self.budget_ms = budget_ms
+        self.target_bitrate = target_bitrate
+
+        self.encode_ms = 0.0
+        self.bytes_per_frame = 0.0
+        self.fps = 0.0
+        self.last_encode_time: float | None = None
+        self.encoded_count = 0
+        self.skipped_count = 0
+
+        self.condition = threading.Condition()
+        self.pending: tuple[np.ndarray, Any] | None = None  # (image, context)
+        self.output: tuple[bytes, Any] | None = None  # (JPEG, context)
+        self.running = False
+        self.thread: threading.Thread | None = None
+
+    @property
+    def quality(self) -> int:
+        """JPEG quality of the current level."""
+        return self.levels[self.level][0]
+
+    @property
+    def subsampling(self) -> str:
+        """Chroma subsampling of the current level."""
+        return "4:4:4" if self.levels[self.level][1] == _SAMPLING_FACTOR_444 else "4:2:0"
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Encode the image at the current level and adapt the level. (呼び出したスレッドでエンコードする)
+
+        Args:
+            image (np.ndarray): image(BGR)
+
+        Returns:
+            bytes: JPEG
+        """
+        quality, sampling_factor = self.levels[self.level]
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        if _SAMPLING_FACTOR is not None and sampling_factor is not None:
+            params += [_SAMPLING_FACTOR, sampling_factor]
+
+        start_time = time.perf_counter()
+        _, imencode_image = cv2.imencode(".jpg", image, params)
+        jpeg = imencode_image.tobytes()
+        self._update(time.perf_counter() - start_time, len(jpeg))
+        return jpeg
+
+    def start(self) -> None:
+        """Start the encoder thread."""
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="jpeg-encoder", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop the encoder thread."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.pending = None
+        self.output = None
+
+    def submit(self, image: np.ndarray, context: Any = None) -> None:
+        """Request encoding on the encoder thread. (まだエンコードしていないフレームは捨てる)
+
+        Args:
+            image (np.ndarray): image(BGR)
+            context (Any, optional): returned with the JPEG by get. Defaults to None.
+        """
+        with self.condition:
+            if self.pending is not None:
+                self.skipped_count += 1
+            self.pending = (image, context)
+            self.condition.notify()
+
+    def get(self) -> tuple[bytes, Any] | None:
+        """Get the newest encoded frame that has not been got yet.
+
+        Returns:
+            tuple[bytes, Any] | None: (JPEG, context passed to submit). None if there is no new frame.
+        """
+        with self.condition:
+            output, self.output = self.output, None
+        return output
+
+    def get_stats(self) -> dict[str, float | int | str]:
+        """Get metrics.
+
+        Returns:
+            dict[str, float | int | str]: metrics
+        """
+        return {
+            "encode_ms": self.encode_ms,
+            "bytes_per_frame": self.bytes_per_frame,
+            "bitrate": self.bytes_per_frame * self.fps,
+            "quality": self.quality,
+            "subsampling": self.subsampling,
+            "encoded_count": self.encoded_count,
+            "skipped_count": self.skipped_count,
+        }
+
+    def _run(self) -> None:
+        """submitされたフレームをエンコードし続ける."""
+        while self.running:
+            with self.condition:
+                if self.pending is None:
+                    self.condition.wait(self.WAIT_TIMEOUT)
+                pending, self.pending = self.pending, None
+            if pending is None:
+                continue
+            image, context = pending
+            jpeg = self.encode(image)
+            with self.condition:
+                self.output = (jpeg, context)
+
+    def _update(self, encode_time: float, num_bytes: int) -> None:
+        """指標を更新し、予算・目標に合わせてレベルを変える.
+
+        Args:
+            encode_time (float): encode time (s)
+            num_bytes (int): size of the JPEG
+        """
+        now = time.time()
+        if self.last_encode_time is not None and now > self.last_encode_time:
+            self.fps += self.SMOOTHING * (1.0 / (now - self.last_encode_time) - self.fps)
+        self.last_encode_time = now
+        if self.encoded_count == 0:
+            self.encode_ms, self.bytes_per_frame = encode_time * 1000, float(num_bytes)
+        else:
+            self.encode_ms += self.SMOOTHING * (encode_time * 1000 - self.encode_ms)
+            self.bytes_per_frame += self.SMOOTHING * (num_bytes - self.bytes_per_frame)
+        self.encoded_count += 1
+
+        ratios = []  # 予算・目標に対する割合
+        if self.budget_ms is not None:
+            ratios.append(self.encode_ms / self.budget_ms)
+        if self.target_bitrate is not None and self.fps > 0:
+            ratios.append(self.bytes_per_frame * self.fps / self.target_bitrate)
+        if not ratios:
+            return
+        if max(ratios) > 1.0:
+            self.level = max(self.level - 1, 0)
+        elif max(ratios) < self.HEADROOM:
+            self.level = min(self.level + 1, len(self.levels) - 1)
+
+
+def get_content_box(image: np.ndarray, align: int = 16) -> tuple[int, int, int, int] | None:
+    """Get the bounding box of non-black pixels.
+
+    Args:
+        image (np.ndarray): image(BGR)
+        align (int, optional): align the box to this size. Defaults to 16. (JPEGのMCUに合わせて、境界の劣化を避ける)
+
+    Returns:
+        tuple[int, int, int, int] | None: (x, y, width, height). None if the image is all black.
+    """
+    height, width = image.shape[:2]
+    rows = np.flatnonzero(image.reshape(height, -1).max(axis=1))
+    if len(rows) == 0:
+        return None
+    top, bottom = rows[0], rows[-1] + 1
+    # 行の範囲だけで、列ごとの最大値を求める (行方向に連続したメモリを読むので速い)
+    cols = np.flatnonzero(image[top:bottom].reshape(bottom - top, -1).max(axis=0).reshape(width, -1).max(axis=1))
+    left, right = cols[0], cols[-1] + 1
+
+    left, top = left // align * align, top // align * align
+    right, bottom = min(-(-right // align) * align, width), min(-(-bottom // align) * align, height)
+    return int(left), int(top), int(right - left), int(bottom - top)
@@ -1,6 +1,8 @@
 # https://github.com/google/mediapipe/blob/master/mediapipe/python/solutions/face_mesh.py
 
-from typing import Final
+import threading
+from itertools import chain
+from typing import Any, Final
 
 import cv2
 import mediapipe as mp
@@ -10,6 +12,11 @@ mp_face_mesh: Final = mp.solutions.face_mesh
 
 
 class FaceMesh:
+    """mediapipeのFaceMeshのラッパー.
+
+    mediapipeのグラフ・推論結果・BGR→RGB変換のバッファを共有するので、推論はlockで1スレッドずつ行う.
+    """
+
     def __init__(
         self,
         max_num_faces: int = 1,
@@ -26,30 +33,113 @@ class FaceMesh:
             static_image_mode=static_image_mode,
         )
         self.face_mesh_results = None
+        self.rgb_image: np.ndarray | None = None  # BGR→RGB変換の出力先 (フレームごとに確保しないように使い回す)
+        self.lock = threading.Lock()  # 別のスレッドから呼ばれても、推論中にrgb_imageと結果を上書きさせない
 
-    def get_landmarks(self, image: np.ndarray, return_original_style: bool = False) -> np.ndarray:
+    def get_landmarks(
+        self,
+        image: np.ndarray,
+        return_original_style: bool = False,
+        is_rgb: bool = False,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
         """Get landmarks.
 
         Args:
             image (np.ndarray): image(BGR)
             return_original_style (bool, optional): return original style. Defaults to False.
+            is_rgb (bool, optional): image is already RGB (use it without copying). Defaults to False.
+            out (np.ndarray | None, optional): buffer to store the landmarks (landmarks x 3, float32).
+                Defaults to None. (If None, allocate a new array)
 
         Returns:
-            _type_: landmarks
+            _type_: landmarks (landmarks x 3, float32)
         """
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        self.face_mesh_results = self.face_mesh.process(image)
+        with self.lock:
+            self._process(image, is_rgb)
+
+            if not self.face_mesh_results.multi_face_landmarks:  # type: ignore
+                raise Exception("No face detected.")
+
+            if return_original_style:
+                return self.face_mesh_results.multi_face_landmarks[0]  # type: ignore
+
+            return self._to_array(self.face_mesh_results.multi_face_landmarks[0], image.shape, out)  # type: ignore
 
-        if not self.face_mesh_results.multi_face_landmarks:  # type: ignore
-            raise Exception("No face detected.")
+    def get_multi_face_landmarks(
+        self, image: np.ndarray, is_rgb: bool = False, out: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Get landmarks of all detected faces (up to max_num_faces).
+
+        Args:
+            image (np.ndarray): image(BGR)
+            is_rgb (bool, optional): image is already RGB (use it without copying). Defaults to False.
+            out (np.ndarray | None, optional): buffer to store the landmarks (max_num_faces x landmarks x 3, float32).
+                Defaults to None. (If None, allocate a new array)
+
+        Returns:
+            np.ndarray: landmarks (faces x landmarks x 3, float32). (outを指定した場合はその先頭の顔の部分)
+        """
+        with self.lock:
+            self._process(image, is_rgb)
 
-        if return_original_style:
-            return self.face_mesh_results.multi_face_landmarks[0]  # type: ignore
+            if not self.face_mesh_results.multi_face_landmarks:  # type: ignore
+                raise Exception("No face detected.")
 
-        landmarks = []
-        for landmark in self.face_mesh_results.multi_face_landmarks[0].landmark:  # type: ignore
-            landmarks.append([landmark.x * image.shape[1], landmark.y * image.shape[0], landmark.z])
-        return np.array(landmarks)
+            multi_face_landmarks = self.face_mesh_results.multi_face_landmarks  # type: ignore
+            if out is None:
+                landmarks = np.empty((len(multi_face_landmarks), len(multi_face_landmarks[0].landmark), 3), np.float32)
+            else:
+                landmarks = out[: len(multi_face_landmarks)]
+            for face_landmarks, face_out in zip(multi_face_landmarks, landmarks):
+                self._to_array(face_landmarks, image.shape, face_out)
+            return landmarks
+
+    def _process(self, image: np.ndarray, is_rgb: bool) -> None:
+        """Run the model and store the result in self.face_mesh_results.
+
+        Args:
+            image (np.ndarray): image(BGR or RGB)
+            is_rgb (bool): image is already RGB
+        """
+        if is_rgb:
+            rgb_image = image
+        else:
+            if self.rgb_image is None or self.rgb_image.shape != image.shape:
+                self.rgb_image = np.empty_like(image)
+            self.rgb_image.flags.writeable = True
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self.rgb_image)
+
+        # 書き込み不可にすると、mediapipeは画像をコピーせずに参照する
+        writeable = rgb_image.flags.writeable
+        rgb_image.flags.writeable = False
+        try:
+            self.face_mesh_results = self.face_mesh.process(rgb_image)
+        finally:
+            rgb_image.flags.writeable = writeable
+
+    def _to_array(self, face_landmarks: Any, shape: tuple[int, ...], out: np.ndarray | None = None) -> np.ndarray:
+        """Convert landmarks of a face to an array in pixel coordinates.
+
+        Args:
+            face_landmarks (_type_): landmarks of a face (NormalizedLandmarkList)
+            shape (tuple[int, ...]): shape of the image
+            out (np.ndarray | None, optional): buffer to store the landmarks (landmarks x 3). Defaults to None.
+
+        Returns:
+            np.ndarray: landmarks (landmarks x 3, float32)
+        """
+        # solutions APIの結果はprotobufなので、ランドマークごとにPythonで読み出すコストは残る (478点で約0.1ms)
+        landmark_list = face_landmarks.landmark
+        if out is None:
+            out = np.empty((len(landmark_list), 3), np.float32)
+        out[...] = np.fromiter(
+            chain.from_iterable((landmark.x, landmark.y, landmark.z) for landmark in landmark_list),
+            dtype=np.float32,
+            count=3 * len(landmark_list),
+        ).reshape(-1, 3)
+        out *= np.array([shape[1], shape[0], 1], np.float32)  # 正規化座標→画素座標
+        return out
 
     def close(self) -> None:
         """Close."""
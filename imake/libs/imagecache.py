@@ -0,0 +1,136 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Final, Hashable
+
+import cv2
+import numpy as np
+
+ASSET_CACHE_BYTES: Final = 256 * 1024 * 1024  # 読み込んだ素材画像のキャッシュの上限 (1024x1024のBGRAで64枚)
+EFFECT_CACHE_BYTES: Final = 128 * 1024 * 1024  # 合成したエフェクト画像のキャッシュの上限
+
+
+class ImageCache:
+    """メモリ使用量に上限のあるLRUキャッシュ (スレッドセーフ).
+
+    入れた配列はread-onlyにして共有するので、取り出した側で書き換えないこと.
+    """
+
+    def __init__(self, max_bytes: int):
+        """Initialize ImageCache.
+
+        Args:
+            max_bytes (int): maximum total bytes of the cached arrays. (0 disables the cache)
+        """
+        self.max_bytes = max_bytes
+        self.images: OrderedDict[Hashable, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self.cached_bytes = 0
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, key: Hashable) -> np.ndarray | None:
+        """Get the cached array.
+
+        Args:
+            key (Hashable): key
+
+        Returns:
+            np.ndarray | None: read-only array. None if not cached.
+        """
+        with self.lock:
+            image = self.images.get(key)
+            if image is None:
+                self.miss_count += 1
+                return None
+            self.images.move_to_end(key)
+            self.hit_count += 1
+            return image
+
+    def put(self, key: Hashable, image: np.ndarray) -> np.ndarray:
+        """Cache the array. (上限を超えたら、最も長く使われていないものから捨てる)
+
+        Args:
+            key (Hashable): key
+            image (np.ndarray): array. read-onlyにされる.
+
+        Returns:
+            np.ndarray: the cached array
+        """
+        image.setflags(write=False)
+        if image.nbytes > self.max_bytes:  # 1枚で上限を超えるものは入れない
+            return image
+        with self.lock:
+            old_image = self.images.pop(key, None)
+            if old_image is not None:
+                self.cached_bytes -= old_image.nbytes
+            self.images[key] = image
+            self.cached_bytes += image.nbytes
+            while self.cached_bytes > self.max_bytes:
+                _, evicted = self.images.popitem(last=False)
+                self.cached_bytes -= evicted.nbytes
+        return image
+
+    def clear(self) -> None:
+        """Remove all cached arrays."""
+        with self.lock:
+            self.images.clear()
+            self.cached_bytes = 0
+
+    def get_stats(self) -> dict[str, int]:
+        """Get hit and miss counts and the cached arrays.
+
+        Returns:
+            dict[str, int]: stats
+        """
+        with self.lock:
+            return {
+                "hit_count": self.hit_count,
+                "miss_count": self.miss_count,
+                "image_count": len(self.images),
+                "cached_bytes": self.cached_bytes,
+            }
+
+
+# プロセス全体で共有するキャッシュ
+asset_cache = ImageCache(ASSET_CACHE_BYTES)
+effect_cache = ImageCache(EFFECT_CACHE_BYTES)
+
+
+def get_asset_key(path: str) -> tuple[str, int] | None:
+    """ファイルの内容を表すキー (パスと更新時刻) を取得する. (ファイルを書き換えたら別のキーになる)
+
+    Args:
+        path (str): file path
+
+    Returns:
+        tuple[str, int] | None: (absolute path, mtime in ns). None if the file does not exist.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return os.path.abspath(path), mtime
+
+
+def read_image(path: str, flags: int = cv2.IMREAD_UNCHANGED) -> np.ndarray | None:
+    """cv2.imreadの結果をasset_cacheにキャッシュして返す.
+
+    Args:
+        path (str): file path
+        flags (int, optional): flags for cv2.imread. Defaults to cv2.IMREAD_UNCHANGED.
+
+    Returns:
+        np.ndarray | None: read-only image. None if failed to read. (cv2.imreadと同じ)
+    """
+    asset_key = get_asset_key(path)
+    if asset_key is None:
+        return None
+    key = (asset_key, flags)
+    image = asset_cache.get(key)
+    if image is None:
+        image = cv2.imread(path, flags)
+        if image is None:
+            return None
+        image = asset_cache.put(key, image)
+    return image
@@ -0,0 +1,237 @@
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from typing import Any, Final
+
+import numpy as np
+
+from .facemesh import FaceMesh
+
+NUM_LANDMARKS: Final = 468
+NUM_REFINED_LANDMARKS: Final = 478  # refine_landmarks=Trueでは虹彩のランドマークが追加される
+
+_STOP: Final = -1  # ワーカーを止めるタスク
+
+
+class InferenceService:
+    """FaceMeshの推論を複数のプロセスで並列に行う.
+
+    フレームとランドマークは共有メモリのリングバッファでやり取りし、キューにはスロット番号だけを流す(画像をpickleしない).
+    結果は投入した順(シーケンス番号順)に取り出す.
+    """
+
+    RESULT_TIMEOUT: Final = 1.0  # getで待つ場合の上限(秒)
+
+    def __init__(
+        self,
+        num_workers: int,
+        frame_shape: tuple[int, int, int],
+        num_slots: int | None = None,
+        max_num_faces: int = 1,
+        refine_landmarks: bool = True,
+    ):
+        """Initialize InferenceService and start the workers.
+
+        Args:
+            num_workers (int): number of worker processes
+            frame_shape (tuple[int, int, int]): shape of the frames (height, width, 3)
+            num_slots (int | None, optional): number of frames in the ring buffer. Defaults to None. (2 x num_workers)
+            max_num_faces (int, optional): max_num_faces of FaceMesh. Defaults to 1.
+            refine_landmarks (bool, optional): refine_landmarks of FaceMesh. Defaults to True.
+        """
+        self.frame_shape = frame_shape
+        self.num_slots = num_slots if num_slots is not None else 2 * num_workers
+        num_landmarks = NUM_REFINED_LANDMARKS if refine_landmarks else NUM_LANDMARKS
+        self.landmarks_shape = (max_num_faces, num_landmarks, 3)
+
+        self.frames_memory = shared_memory.SharedMemory(create=True, size=self.num_slots * int(np.prod(frame_shape)))
+        self.landmarks_memory = shared_memory.SharedMemory(
+            create=True, size=self.num_slots * int(np.prod(self.landmarks_shape)) * np.dtype(np.float32).itemsize
+        )
+        self.frames = np.ndarray((self.num_slots, *frame_shape), np.uint8, self.frames_memory.buf)
+        self.landmarks = np.ndarray((self.num_slots, *self.landmarks_shape), np.float32, self.landmarks_memory.buf)
+
+        context = mp.get_context("spawn")  # mediapipeをfork後に使うと固まるので、spawnで起動する
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        self.workers = [
+            context.Process(
+                target=_run_worker,
+                args=(
+                    self.frames_memory.name,
+                    self.landmarks_memory.name,
+                    (self.num_slots, *frame_shape),
+                    (self.num_slots, *self.landmarks_shape),
+                    self.task_queue,
+                    self.result_queue,
+                    dict(max_num_faces=max_num_faces, refine_landmarks=refine_landmarks),
+                ),
+                daemon=True,
+            )
+            for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.next_seq = 0  # 次に投入するフレームのシーケンス番号
+        self.next_result_seq = 0  # 次に返す結果のシーケンス番号
+        self.contexts: dict[int, Any] = {}  # 投入中のフレームのcontext
+        self.num_faces: dict[int, int] = {}  # 推論が終わったフレームの顔の数 (返す順番を待っているもの)
+
+    def get_num_in_flight(self) -> int:
+        """Get the number of submitted frames whose results are not returned yet.
+
+        Returns:
+            int: number of frames
+        """
+        return self.next_seq - self.next_result_seq
+
+    def is_full(self) -> bool:
+        """Whether all slots of the ring buffer are in use.
+
+        Returns:
+            bool: True if submit will fail
+        """
+        return self.get_num_in_flight() >= self.num_slots
+
+    def submit(self, image: np.ndarray, context: Any = None) -> int | None:
+        """Copy the frame into the ring buffer and request inference.
+
+        Args:
+            image (np.ndarray): image(BGR). Must be frame_shape.
+            context (Any, optional): returned with the result (e.g. capture time and image). Defaults to None.
+
+        Returns:
+            int | None: sequence number. None if the ring buffer is full.
+        """
+        if image.shape != self.frame_shape:
+            raise ValueError(f"Frame shape must be {self.frame_shape}")
+        if self.is_full():
+            return None
+
+        seq = self.next_seq
+        self.frames[seq % self.num_slots] = image
+        self.contexts[seq] = context
+        self.task_queue.put((seq % self.num_slots, seq))
+        self.next_seq += 1
+        return seq
+
+    def get(self, wait: bool = False) -> tuple[Any, np.ndarray | None] | None:
+        """Get the result of the oldest submitted frame.
+
+        Args:
+            wait (bool, optional): wait for the result (up to RESULT_TIMEOUT). Defaults to False.
+
+        Returns:
+            tuple[Any, np.ndarray | None] | None: (context, landmarks (faces x landmarks x 3)). landmarks is None if
+                no face is detected. None if the result is not ready.
+        """
+        seq = self.next_result_seq
+        if seq == self.next_seq:
+            return None
+
+        self._receive(False)
+        if seq not in self.num_faces and wait:
+            try:
+                while seq not in self.num_faces:
+                    self._receive(True)
+            except queue.Empty:
+                pass
+        if seq not in self.num_faces:
+            return None
+
+        num_faces = self.num_faces.pop(seq)
+        landmarks = self.landmarks[seq % self.num_slots, :num_faces].copy() if num_faces > 0 else None
+        self.next_result_seq += 1
+        return self.contexts.pop(seq), landmarks
+
+    def drain(self) -> None:
+        """Wait for the frames in flight and discard their results. (次に投入したフレームの結果から返す)
+
+        ワーカーが止まっていて結果が返らない場合は、待たずに捨てる. (遅れて届いた結果は_receiveで捨てる)
+        """
+        while self.get_num_in_flight() > 0:
+            if self.get(True) is None:
+                break
+        self.contexts.clear()
+        self.num_faces.clear()
+        self.next_result_seq = self.next_seq
+
+    def close(self) -> None:
+        """Stop the workers and release the shared memory."""
+        for _ in self.workers:
+            self.task_queue.put((_STOP, _STOP))
+        for worker in self.workers:
+            worker.join()
+        del self.frames, self.landmarks  # 共有メモリを参照している配列を先に消す
+        for memory in (self.frames_memory, self.landmarks_memory):
+            memory.close()
+            memory.unlink()
+
+    def _receive(self, block: bool) -> None:
+        """Receive finished results from the workers.
+
+        Args:
+            block (bool): wait for a result (up to RESULT_TIMEOUT). Raises queue.Empty on timeout.
+        """
+        if block:
+            seq, num_faces = self.result_queue.get(timeout=self.RESULT_TIMEOUT)
+            self._store_result(seq, num_faces)
+        while True:
+            try:
+                seq, num_faces = self.result_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._store_result(seq, num_faces)
+
+    def _store_result(self, seq: int, num_faces: int) -> None:
+        """Store a received result. (drainで捨てたフレームの結果は無視する)
+
+        Args:
+            seq (int): sequence number
+            num_faces (int): number of detected faces
+        """
+        if seq >= self.next_result_seq:
+            self.num_faces[seq] = num_faces
+
+
+def _run_worker(
+    frames_name: str,
+    landmarks_name: str,
+    frames_shape: tuple[int, ...],
+    landmarks_shape: tuple[int, ...],
+    task_queue: Any,
+    result_queue: Any,
+    face_mesh_kwargs: dict[str, Any],
+) -> None:
+    """ワーカープロセス: 共有メモリのフレームを推論し、ランドマークを共有メモリに書き込む.
+
+    Args:
+        frames_name (str): name of the shared memory of the frames
+        landmarks_name (str): name of the shared memory of the landmarks
+        frames_shape (tuple[int, ...]): shape of the frame ring buffer
+        landmarks_shape (tuple[int, ...]): shape of the landmark ring buffer
+        task_queue (Any): queue of (slot, seq)
+        result_queue (Any): queue of (seq, number of faces)
+        face_mesh_kwargs (dict[str, Any]): arguments of FaceMesh
+    """
+    frames_memory = shared_memory.SharedMemory(name=frames_name)
+    landmarks_memory = shared_memory.SharedMemory(name=landmarks_name)
+    frames = np.ndarray(frames_shape, np.uint8, frames_memory.buf)
+    landmarks = np.ndarray(landmarks_shape, np.float32, landmarks_memory.buf)
+    face_mesh = FaceMesh(**face_mesh_kwargs)
+    try:
+        while True:
+            slot, seq = task_queue.get()
+            if slot == _STOP:
+                break
+            try:
+                num_faces = len(face_mesh.get_multi_face_landmarks(frames[slot], out=landmarks[slot]))
+            except Exception:
+                num_faces = 0
+            result_queue.put((seq, num_faces))
+    finally:
+        face_mesh.close()
+        del frames, landmarks
+        frames_memory.close()
+        landmarks_memory.close()
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Final
+
+
+class DropOldestQueue:
+    """上限を超えたら最も古い要素を捨てるキュー (スレッドセーフ)."""
+
+    def __init__(self, maxsize: int):
+        """Initialize DropOldestQueue.
+
+        Args:
+            maxsize (int): maximum number of items
+        """
+        self.items: deque[Any] = deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped_count = 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, item: Any) -> None:
+        """Put an item. (満杯なら最も古い要素を捨てる)
+
+        Args:
+            item (Any): item
+        """
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped_count += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout: float | None = None) -> Any | None:
+        """Get the oldest item.
+
+        Args:
+            timeout (float | None, optional): seconds to wait for an item. Defaults to None. (If None, do not wait)
+
+        Returns:
+            Any | None: item. None if the queue is empty.
+        """
+        with self.condition:
+            if not self.items and timeout is not None:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+    def clear(self) -> None:
+        """Remove all items."""
+        with self.condition:
+            self.items.clear()
+
+
+class Pipeline:
+    """各ステージを専用のスレッドで動かし、ステージ間を上限付きのDropOldestQueueでつなぐ.
+
+    最初のステージは引数なしで呼ばれ、フレームを作る. 他のステージは前のステージの出力を受け取る.
+    ステージの関数がNoneを返した場合、そのフレームは捨てる. 最後のステージの出力はgetで取り出す.
+    """
+
+    POLL_TIMEOUT: Final = 0.1  # stopを確認する間隔(秒)
+    SOURCE_RETRY_INTERVAL: Final = 0.1  # 最初のステージが失敗したときに、次に呼ぶまでの時間(秒) (ビジーループを避ける)
+
+    def __init__(self, stages: list[tuple[str, Callable]], maxsize: int = 2):
+        """Initialize Pipeline.
+
+        Args:
+            stages (list[tuple[str, Callable]]): (name, function) of each stage
+            maxsize (int, optional): maximum number of frames in each queue. Defaults to 2.
+        """
+        self.stages = stages
+        self.queues = {name: DropOldestQueue(maxsize) for name, _ in stages}  # 各ステージの出力先
+        self.error_counts = {name: 0 for name, _ in stages}
+        self.last_errors: dict[str, Exception] = {}
+        self.stop_event = threading.Event()
+        self.threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        """Start a thread for each stage."""
+        self.stop_event.clear()
+        input_queue = None
+        for name, func in self.stages:
+            thread = threading.Thread(
+                target=self._run_stage, args=(name, func, input_queue), name=f"pipeline-{name}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+            input_queue = self.queues[name]
+
+    def stop(self) -> None:
+        """Stop all stages and discard queued frames."""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        for queue in self.queues.values():
+            queue.clear()
+
+    def get(self, timeout: float | None = None) -> Any | None:
+        """Get an output of the last stage.
+
+        Args:
+            timeout (float | None, optional): seconds to wait. Defaults to None. (If None, do not wait)
+
+        Returns:
+            Any | None: output. None if there is no output.
+        """
+        return self.queues[self.stages[-1][0]].get(timeout)
+
+    def get_queue_depths(self) -> dict[str, int]:
+        """Get the number of frames waiting in the output queue of each stage.
+
+        Returns:
+            dict[str, int]: stage name -> depth
+        """
+        return {name: len(queue) for name, queue in self.queues.items()}
+
+    def get_dropped_counts(self) -> dict[str, int]:
+        """Get the number of frames dropped from the output queue of each stage.
+
+        Returns:
+            dict[str, int]: stage name -> dropped count
+        """
+        return {name: queue.dropped_count for name, queue in self.queues.items()}
+
+    def _run_stage(self, name: str, func: Callable, input_queue: DropOldestQueue | None) -> None:
+        """ステージの処理を繰り返す.
+
+        Args:
+            name (str): stage name
+            func (Callable): stage function
+            input_queue (DropOldestQueue | None): output queue of the previous stage (None for the first stage)
+        """
+        output_queue = self.queues[name]
+        while not self.stop_event.is_set():
+            if input_queue is None:
+                args: tuple[Any, ...] = ()
+            else:
+                item = input_queue.get(self.POLL_TIMEOUT)
+                if item is None:
+                    continue
+                args = (item,)
+
+            try:
+                output = func(*args)
+            except Exception as e:
+                self.error_counts[name] += 1
+                self.last_errors[name] = e
+                print(name, e, time.time())
+                if input_queue is None:
+                    self.stop_event.wait(self.SOURCE_RETRY_INTERVAL)
+                continue
+            if output is not None:
+                output_queue.put(output)
@@ -0,0 +1,97 @@
+import threading
+import time
+from typing import Final
+
+import cv2
+import numpy as np
+
+
+class ProjectorWindow:
+    """描画したフレームを、ブラウザを通さずにOpenCVのフルスクリーンウィンドウに直接表示する.
+
+    ウィンドウは専用のスレッドで作り、ディスプレイのリフレッシュレートの間隔で最新のフレームだけを表示する.
+    表示される前に新しいフレームで上書きされたものはdropped_countに数える.
+    """
+
+    WINDOW_NAME: Final = "IMake Projector"
+    FPS_SMOOTHING: Final = 0.1  # present_fpsの指数移動平均の重み
+
+    def __init__(self, position: tuple[int, int] = (0, 0), refresh_rate: float = 60.0):
+        """Open the window and start the display thread.
+
+        Args:
+            position (tuple[int, int], optional): top left of the display in the virtual desktop. Defaults to (0, 0).
+                (プロジェクターを2枚目のディスプレイにしている場合は、その左上の座標を渡す)
+            refresh_rate (float, optional): refresh rate of the display (Hz). Defaults to 60.0.
+        """
+        self.position = position
+        self.interval = 1.0 / refresh_rate
+        self.condition = threading.Condition()
+        self.frame: np.ndarray | None = None
+        self.frame_count = 0  # showで受け取ったフレームの数
+        self.presented_count = 0
+        self.dropped_count = 0
+        self.present_fps = 0.0
+        self.error: Exception | None = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="projector", daemon=True)
+        self.thread.start()
+
+    def show(self, frame: np.ndarray) -> None:
+        """Show the frame at the next refresh. (どのスレッドからでも呼べる)
+
+        Args:
+            frame (np.ndarray): frame(BGR). 表示が終わるまで書き換えないこと.
+        """
+        with self.condition:
+            self.frame = frame
+            self.frame_count += 1
+
+    def clear(self) -> None:
+        """Show a black frame."""
+        with self.condition:
+            shape = self.frame.shape if self.frame is not None else (1, 1, 3)
+        self.show(np.zeros(shape, np.uint8))
+
+    def close(self) -> None:
+        """Stop the display thread and close the window."""
+        self.running = False
+        self.thread.join()
+
+    def _run(self) -> None:
+        """ウィンドウを作り、リフレッシュごとに最新のフレームを表示し続ける. (ウィンドウの操作はすべてこのスレッドで行う)"""
+        try:
+            cv2.namedWindow(self.WINDOW_NAME, cv2.WINDOW_NORMAL)
+            cv2.moveWindow(self.WINDOW_NAME, *self.position)
+            cv2.setWindowProperty(self.WINDOW_NAME, cv2.WND_PROP_FULLSCREEN, cv2.WINDOW_FULLSCREEN)
+        except cv2.error as e:  # GUIのないOpenCV (opencv-python-headless) など
+            self.error = e
+            print("projector", e, time.time())
+            return
+
+        last_presented_count = 0
+        last_present_time: float | None = None
+        next_refresh_time = time.perf_counter()
+        try:
+            while self.running:
+                now = time.perf_counter()
+                if now < next_refresh_time:
+                    time.sleep(next_refresh_time - now)
+                # 遅れた場合は、まとめて表示せずに次のリフレッシュに合わせ直す
+                next_refresh_time = max(next_refresh_time + self.interval, time.perf_counter())
+
+                with self.condition:
+                    frame, frame_count = self.frame, self.frame_count
+                if frame is not None and frame_count > last_presented_count:
+                    cv2.imshow(self.WINDOW_NAME, frame)
+                    self.dropped_count += frame_count - last_presented_count - 1
+                    last_presented_count = frame_count
+                    self.presented_count += 1
+                    present_time = time.perf_counter()
+                    if last_present_time is not None and present_time > last_present_time:
+                        fps = 1.0 / (present_time - last_present_time)
+                        self.present_fps += self.FPS_SMOOTHING * (fps - self.present_fps)
+                    last_present_time = present_time
+                cv2.waitKey(1)  # ウィンドウのイベントを処理する
+        finally:
+            cv2.destroyWindow(self.WINDOW_NAME)
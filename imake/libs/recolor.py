@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from typing import Final, Hashable
+
+import cv2
+import numpy as np
+
+MAX_RECOLORERS: Final = 32  # プロセス内に保持するRecolorerの数 (超えたら最も長く使われていないものを捨てる)
+
+
+class Recolorer:
+    """RGB=(0,0,255)で塗ったアルファチャンネル付きの素材の色を変える.
+
+    素材ごとに一度だけ、アルファを掛けたBGRをHSVにして、色を変える画素のマスクと明度(V)のチャンネルを作っておく.
+    色を変える画素の結果はVだけで決まるので、色ごとの処理は256色のテーブルを作ってcv2.LUTを引くだけになる.
+    それ以外の画素(色相・彩度の片方だけが範囲内など)は少ないので、その画素だけを変換する.
+    どちらもアルファが0でない範囲の外接矩形だけで行う. (外側は常に黒になる)
+    """
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        hue_range: tuple[float, float],
+        sat_range: tuple[float, float],
+        no_change_val: int,
+    ):
+        """Precompute the recolorable mask and the value channel.
+
+        Args:
+            image (np.ndarray): BGRA image
+            hue_range (tuple[float, float]): 色相を変える範囲 (OpenCVのHSV, 両端を含まない)
+            sat_range (tuple[float, float]): 彩度を変える範囲 (OpenCVのHSV, 両端を含まない)
+            no_change_val (int): 明度を変えない値
+        """
+        self.shape = image.shape[:2]
+        self.no_change_val = no_change_val
+        self.rect = cv2.boundingRect(image[:, :, 3])
+        x, y, w, h = self.rect
+
+        bgra = image[y : y + h, x : x + w]
+        alpha = bgra[:, :, 3]
+        bgr = (bgra[:, :, :3] * np.dstack([alpha / 255] * 3)).astype(np.uint8)
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+        hue, sat, val = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+        is_hue_changed = (hue > hue_range[0]) & (hue < hue_range[1])
+        is_sat_changed = (sat > sat_range[0]) & (sat < sat_range[1])
+
+        # 色を変える画素は、(V, V, V, A)にcv2.LUTを引く (Aのテーブルは恒等)
+        self.val_alpha = cv2.merge((val, val, val, alpha))
+        # それ以外で、黒(V=0)にならない画素
+        self.other_indices = np.flatnonzero(~(is_hue_changed & is_sat_changed) & (val != 0))
+        # cv2.cvtColorは行の端のSIMDで処理しない画素だけ丸めが違うので、元の画像と同じ幅の行に詰めて変換する
+        width = self.shape[1]
+        self.other_hsv = np.zeros((-(-len(self.other_indices) // width) * width, 3), np.uint8)
+        self.other_hsv[: len(self.other_indices)] = hsv.reshape(-1, 3)[self.other_indices]
+        self.other_is_hue_changed = is_hue_changed.reshape(-1)[self.other_indices]
+        self.other_is_sat_changed = is_sat_changed.reshape(-1)[self.other_indices]
+
+    def recolor(self, hue: float, sat: float, val: float, include_alpha_ch: bool) -> np.ndarray:
+        """Recolor the image.
+
+        Args:
+            hue (float): hue (OpenCVのHSV, 0-180)
+            sat (float): saturation (OpenCVのHSV, 0-255)
+            val (float): value (OpenCVのHSV, 0-255). グラデーションの比率を保ったまま、明度をこの値に合わせる
+            include_alpha_ch (bool): returnする画像にアルファチャンネルを含むか否か
+
+        Returns:
+            np.ndarray: BGR or BGRA image
+        """
+        height, width = self.shape
+        output = np.zeros((height, width, 4), np.uint8)
+        x, y, w, h = self.rect
+        if w > 0 and h > 0:
+            # 元のVに対する変更後のV (小数点以下は切り捨て)
+            val_lut = (val * (np.arange(256) / 255)).astype(np.uint8)
+            val_lut[self.no_change_val] = self.no_change_val
+            # 色を変える画素のVに対するBGRと、恒等のA
+            table_hsv = np.empty((1, 256, 3), np.uint8)
+            table_hsv[0, :, 0] = hue
+            table_hsv[0, :, 1] = sat
+            table_hsv[0, :, 2] = val_lut
+            table = cv2.cvtColor(cv2.cvtColor(table_hsv, cv2.COLOR_HSV2BGR), cv2.COLOR_BGR2BGRA)
+            table[0, :, 3] = np.arange(256)
+            roi = cv2.LUT(self.val_alpha, table)
+
+            num_others = len(self.other_indices)
+            if num_others > 0:
+                other_hsv = self.other_hsv.copy()
+                other_hsv[:num_others][self.other_is_hue_changed, 0] = hue
+                other_hsv[:num_others][self.other_is_sat_changed, 1] = sat
+                other_hsv[:, 2] = val_lut[other_hsv[:, 2]]
+                other_bgr = cv2.cvtColor(other_hsv.reshape(-1, width, 3), cv2.COLOR_HSV2BGR)
+                roi.reshape(-1, 4)[self.other_indices, :3] = other_bgr.reshape(-1, 3)[:num_others]
+            output[y : y + h, x : x + w] = roi
+
+        return output if include_alpha_ch else cv2.cvtColor(output, cv2.COLOR_BGRA2BGR)
+
+
+_recolorers: OrderedDict[Hashable, Recolorer] = OrderedDict()
+_recolorers_lock = threading.Lock()
+
+
+def get_recolorer(
+    key: Hashable | None,
+    image: np.ndarray,
+    hue_range: tuple[float, float],
+    sat_range: tuple[float, float],
+    no_change_val: int,
+) -> Recolorer:
+    """keyごとにRecolorerを作って、プロセス内にキャッシュする.
+
+    Args:
+        key (Hashable | None): 素材の内容を表すキー. Noneならキャッシュしない.
+        image (np.ndarray): BGRA image
+        hue_range (tuple[float, float]): 色相を変える範囲
+        sat_range (tuple[float, float]): 彩度を変える範囲
+        no_change_val (int): 明度を変えない値
+
+    Returns:
+        Recolorer: recolorer
+    """
+    if key is None:
+        return Recolorer(image, hue_range, sat_range, no_change_val)
+
+    key = (key, hue_range, sat_range, no_change_val)
+    with _recolorers_lock:
+        recolorer = _recolorers.get(key)
+        if recolorer is not None:
+            _recolorers.move_to_end(key)
+            return recolorer
+
+    recolorer = Recolorer(image, hue_range, sat_range, no_change_val)
+    with _recolorers_lock:
+        _recolorers[key] = recolorer
+        while len(_recolorers) > MAX_RECOLORERS:
+            _recolorers.popitem(last=False)
+    return recolorer
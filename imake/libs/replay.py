@@ -0,0 +1,218 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Final
+
+import cv2
+import numpy as np
+
+FRAMES_FILE_NAME: Final = "frames.avi"
+SESSION_FILE_NAME: Final = "session.npz"  # timestamps (F), num_faces (F), landmarks (F x faces x N x 3)
+
+
+class SessionRecorder:
+    """カメラのフレーム・ランドマーク・時刻をディレクトリに記録する. (ReplaySourceで再生できる)"""
+
+    FOURCC: Final = "MJPG"
+    FPS: Final = 30.0  # 動画ファイルに書くFPS (再生は記録した時刻に従うので、目安)
+
+    def __init__(self, dir_path: str):
+        """Initialize SessionRecorder.
+
+        Args:
+            dir_path (str): directory to save the session
+        """
+        os.makedirs(dir_path, exist_ok=True)
+        self.dir_path = dir_path
+        self.writer: cv2.VideoWriter | None = None
+        self.timestamps: list[float] = []
+        self.landmarks: list[np.ndarray | None] = []
+        self.closed = False
+
+    def record(self, image: np.ndarray, timestamp: float, landmarks: np.ndarray | None) -> None:
+        """Record a frame.
+
+        Args:
+            image (np.ndarray): camera image(BGR)
+            timestamp (float): capture time
+            landmarks (np.ndarray | None): landmarks of all faces (faces x N x 3). None if no face is detected.
+        """
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(
+                os.path.join(self.dir_path, FRAMES_FILE_NAME),
+                cv2.VideoWriter_fourcc(*self.FOURCC),
+                self.FPS,
+                (image.shape[1], image.shape[0]),
+            )
+            self.writer.set(cv2.VIDEOWRITER_PROP_QUALITY, 100)
+        self.writer.write(image)
+        self.timestamps.append(timestamp)
+        self.landmarks.append(None if landmarks is None else np.array(landmarks, np.float32))
+
+    def close(self) -> None:
+        """Finish the video file and save the timestamps and landmarks. (2回目以降は何もしない)"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+        shapes = [landmarks.shape for landmarks in self.landmarks if landmarks is not None]
+        max_num_faces = max((shape[0] for shape in shapes), default=0)
+        num_landmarks = shapes[0][1] if shapes else 0
+        landmarks = np.full((len(self.landmarks), max_num_faces, num_landmarks, 3), np.nan, np.float32)
+        num_faces = np.zeros(len(self.landmarks), np.int32)
+        for i, face_landmarks in enumerate(self.landmarks):
+            if face_landmarks is not None:
+                landmarks[i, : len(face_landmarks)] = face_landmarks
+                num_faces[i] = len(face_landmarks)
+        np.savez(
+            os.path.join(self.dir_path, SESSION_FILE_NAME),
+            timestamps=np.array(self.timestamps),
+            num_faces=num_faces,
+            landmarks=landmarks,
+        )
+
+
+class ReplaySource:
+    """SessionRecorderで記録したセッションを、カメラ(Camera)の代わりに再生する.
+
+    realtime=Trueでは記録した時刻の間隔で、Falseでは読み込めるだけ速くフレームを返す.
+    landmarks_only=Trueでは動画をデコードせずに黒いフレームを返す. (記録したランドマークを使い、推論を省く)
+    """
+
+    MAX_KEPT_LANDMARKS: Final = 16  # get_landmarksのために覚えておく、直近に返したフレームの数
+
+    def __init__(self, dir_path: str, realtime: bool = True, landmarks_only: bool = False, loop: bool = False):
+        """Open a recorded session.
+
+        Args:
+            dir_path (str): directory of the session
+            realtime (bool, optional): replay at the recorded speed. Defaults to True.
+            landmarks_only (bool, optional): do not decode frames. Defaults to False.
+            loop (bool, optional): replay from the beginning after the last frame. Defaults to False.
+        """
+        session = np.load(os.path.join(dir_path, SESSION_FILE_NAME))
+        self.recorded_timestamps = session["timestamps"]
+        self.num_faces = session["num_faces"]
+        self.landmarks = session["landmarks"]
+        self.realtime = realtime
+        self.landmarks_only = landmarks_only
+        self.loop = loop
+
+        self.cap = cv2.VideoCapture(os.path.join(dir_path, FRAMES_FILE_NAME))
+        self.frame_shape = (
+            int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            3,
+        )
+        self.index = 0
+        self.start_time: float | None = None
+        self.last_read_time: float | None = None
+        self.last_timestamp: float | None = None
+        self.frame_indices: OrderedDict[float, int] = OrderedDict()  # 返した時刻 -> フレームのindex
+        self.capture_fps = 0.0
+        self.dropped_count = 0
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        """Get the next frame. (cv2.VideoCapture.readと同じ形式)
+
+        Returns:
+            tuple[bool, np.ndarray | None]: (success, frame)
+        """
+        try:
+            frame, _ = self.read_with_timestamp()
+        except Exception:
+            return False, None
+        return True, frame
+
+    def read_with_timestamp(self) -> tuple[np.ndarray, float]:
+        """Get the next frame.
+
+        Returns:
+            tuple[np.ndarray, float]: (frame, replay time of the frame). 時刻はget_landmarksのキーになる.
+        """
+        if self.index >= len(self.recorded_timestamps):
+            if not self.loop:
+                raise Exception("Replay finished")
+            self.index = 0
+            self.start_time = None
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+        timestamp = self._wait_for_timestamp()
+        frame = self._read_frame()
+
+        read_time = time.time()
+        if self.last_read_time is not None and read_time > self.last_read_time:
+            self.capture_fps += 0.1 * (1.0 / (read_time - self.last_read_time) - self.capture_fps)
+        self.last_read_time = read_time
+
+        self.frame_indices[timestamp] = self.index
+        while len(self.frame_indices) > self.MAX_KEPT_LANDMARKS:
+            self.frame_indices.popitem(last=False)
+        self.index += 1
+        return frame, timestamp
+
+    def _wait_for_timestamp(self) -> float:
+        """realtimeでは記録した時刻の間隔になるまで待ち、今のフレームを返す時刻を決める.
+
+        Returns:
+            float: replay time of the frame. (前のフレームより必ず後になる)
+        """
+        now = time.time()
+        if self.realtime:
+            elapsed = self.recorded_timestamps[self.index] - self.recorded_timestamps[0]
+            if self.start_time is None:
+                self.start_time = now - elapsed
+            timestamp = self.start_time + elapsed
+            if timestamp > now:
+                time.sleep(timestamp - now)
+        else:
+            timestamp = now
+        if self.last_timestamp is not None and timestamp <= self.last_timestamp:
+            timestamp = self.last_timestamp + 1e-6  # get_landmarksのキーにするので、時刻を重複させない
+        self.last_timestamp = timestamp
+        return timestamp
+
+    def _read_frame(self) -> np.ndarray:
+        """Decode the current frame. (landmarks_onlyでは黒いフレーム)
+
+        Returns:
+            np.ndarray: frame
+        """
+        if self.landmarks_only:
+            return np.zeros(self.frame_shape, np.uint8)
+        ret, frame = self.cap.read()
+        if not ret:
+            raise Exception("Failed to get image")
+        return frame
+
+    def get_landmarks(self, timestamp: float) -> np.ndarray:
+        """Get the recorded landmarks of a frame returned by read_with_timestamp.
+
+        Args:
+            timestamp (float): time returned with the frame
+
+        Returns:
+            np.ndarray: landmarks of all faces (faces x N x 3)
+        """
+        index = self.frame_indices.get(timestamp)
+        if index is None or self.num_faces[index] == 0:
+            raise Exception("No face detected.")
+        return self.landmarks[index, : self.num_faces[index]].copy()
+
+    def get(self, prop_id: int) -> float:
+        """Get a property of the recorded video. (cv2.VideoCapture.get)
+
+        Args:
+            prop_id (int): property id
+
+        Returns:
+            float: value
+        """
+        return self.cap.get(prop_id)
+
+    def release(self) -> None:
+        """Release the video file."""
+        self.cap.release()
@@ -0,0 +1,66 @@
+import threading
+import time
+from typing import Callable, Final, Iterator
+
+
+class FrameStream:
+    """最新のJPEGフレームを、MJPEG (multipart/x-mixed-replace) でHTTPクライアントに配信する.
+
+    各クライアントには送信が終わった時点で最新のフレームだけを送るので、遅いクライアントではフレームが間引かれる.
+    """
+
+    BOUNDARY: Final = "frame"
+    CONTENT_TYPE: Final = f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+    POLL_INTERVAL: Final = 0.005  # 新しいフレームを確認する間隔(秒)
+
+    def __init__(self, sleep: Callable[[float], None] = time.sleep):
+        """Initialize FrameStream.
+
+        Args:
+            sleep (Callable[[float], None], optional): sleep function used while waiting for a frame.
+                Defaults to time.sleep. (geventのサーバーではeel.sleepを渡す)
+        """
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.jpeg: bytes | None = None
+        self.seq = 0  # publishしたフレームの数
+        self.sent_count = 0
+        self.skipped_count = 0  # 送る前に新しいフレームで上書きされたフレームの数 (全クライアントの合計)
+        self.running = True
+
+    def publish(self, jpeg: bytes) -> None:
+        """Set the newest frame. (どのスレッドからでも呼べる)
+
+        Args:
+            jpeg (bytes): JPEG encoded frame
+        """
+        with self.lock:
+            self.jpeg = jpeg
+            self.seq += 1
+
+    def close(self) -> None:
+        """Finish all streams."""
+        self.running = False
+
+    def frames(self) -> Iterator[bytes]:
+        """Generate multipart chunks for a client. (HTTPレスポンスのbodyとして返す)
+
+        Yields:
+            Iterator[bytes]: multipart chunk of a frame
+        """
+        last_seq: int | None = None  # 最初は今のフレームをすぐに送る
+        while self.running:
+            with self.lock:
+                seq, jpeg = self.seq, self.jpeg
+            if seq == last_seq or jpeg is None:
+                self.sleep(self.POLL_INTERVAL)
+                continue
+            if last_seq is not None:
+                self.skipped_count += seq - last_seq - 1
+            last_seq = seq
+            self.sent_count += 1
+            yield (
+                f"--{self.BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode()
+                + jpeg
+                + b"\r\n"
+            )
@@ -0,0 +1,104 @@
+from enum import Enum, auto
+from typing import Final
+
+import cv2
+import numpy as np
+
+
+class ReuseResult(Enum):
+    STILL = auto()  # ランドマークがほぼ動いていないので、前回のoverlayをそのまま使った
+    RIGID = auto()  # 小さな剛体移動なので、前回のoverlayを1回のアフィン変換で動かした
+    FULL = auto()  # 顔が変形したので、overlayを作り直した
+
+
+class TemporalReuse:
+    """直前に作り直したoverlayを、ランドマークの動きが小さいフレームで再利用する."""
+
+    MAX_RIGID_SCALE_CHANGE: Final = 0.05  # これより大きく拡大・縮小する場合は、画質が落ちるので作り直す
+
+    def __init__(self, still_threshold: float, rigid_threshold: float | None = None):
+        """Initialize TemporalReuse.
+
+        Args:
+            still_threshold (float): 全てのランドマークの移動量(px)がこれ未満なら、前回のoverlayをそのまま使う
+            rigid_threshold (float | None, optional): 相似変換で近似したときの誤差(px)がこれ未満なら、
+                前回のoverlayを変換して使う. Defaults to None. (If None, do not use rigid motion)
+        """
+        self.still_threshold = still_threshold
+        self.rigid_threshold = rigid_threshold
+        self.counts = {result: 0 for result in ReuseResult}
+        self.last_result = ReuseResult.FULL
+        self.reset()
+
+    def reset(self) -> None:
+        """Discard the cached overlay."""
+        self.ref_landmarks: np.ndarray | None = None  # overlayを作り直したときのランドマーク (N x 2)
+        self.ref_overlay: np.ndarray | None = None
+
+    def get(self, shape: tuple[int, ...], landmarks: np.ndarray) -> np.ndarray | None:
+        """再利用できるoverlayを取得する.
+
+        Args:
+            shape (tuple[int, ...]): shape of the target image
+            landmarks (np.ndarray): landmarks on the target image
+
+        Returns:
+            np.ndarray | None: overlay (BGRA). None if the overlay must be created again.
+                (STILLの場合は前回と同じ配列を返すので、書き換えないこと)
+        """
+        if (
+            self.ref_landmarks is None
+            or self.ref_overlay is None
+            or self.ref_overlay.shape[:2] != shape[:2]
+            or self.ref_landmarks.shape != landmarks[:, :2].shape
+        ):
+            return self._count(ReuseResult.FULL)
+
+        points = landmarks[:, :2].astype(np.float32)
+        if np.abs(points - self.ref_landmarks).max() < self.still_threshold:
+            return self._count(ReuseResult.STILL, self.ref_overlay)
+
+        if self.rigid_threshold is None:
+            return self._count(ReuseResult.FULL)
+
+        warp_mat, _ = cv2.estimateAffinePartial2D(self.ref_landmarks, points, method=cv2.LMEDS)
+        if warp_mat is None:
+            return self._count(ReuseResult.FULL)
+        scale = np.sqrt(abs(np.linalg.det(warp_mat[:, :2])))
+        residual = np.abs(self.ref_landmarks @ warp_mat[:, :2].T + warp_mat[:, 2] - points).max()
+        if residual >= self.rigid_threshold or abs(scale - 1.0) > self.MAX_RIGID_SCALE_CHANGE:
+            return self._count(ReuseResult.FULL)
+
+        overlay = cv2.warpAffine(
+            self.ref_overlay,
+            warp_mat,
+            (shape[1], shape[0]),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0, 0),
+        )
+        return self._count(ReuseResult.RIGID, overlay)
+
+    def update(self, landmarks: np.ndarray, overlay: np.ndarray) -> None:
+        """作り直したoverlayを保存する.
+
+        Args:
+            landmarks (np.ndarray): landmarks on the target image
+            overlay (np.ndarray): overlay created from the landmarks (BGRA)
+        """
+        self.ref_landmarks = landmarks[:, :2].astype(np.float32)
+        self.ref_overlay = overlay
+
+    def _count(self, result: ReuseResult, overlay: np.ndarray | None = None) -> np.ndarray | None:
+        """Record the result.
+
+        Args:
+            result (ReuseResult): result
+            overlay (np.ndarray | None, optional): overlay to return. Defaults to None.
+
+        Returns:
+            np.ndarray | None: overlay
+        """
+        self.counts[result] += 1
+        self.last_result = result
+        return overlay
@@ -0,0 +1,146 @@
+from typing import Final
+
+import cv2
+import numpy as np
+
+from .facemesh import FaceMesh
+
+
+class LandmarkTracker:
+    """FaceMeshの推論をキーフレームだけで行い、その間はオプティカルフローでランドマークを追跡する.
+
+    テクスチャの強いランドマークをピラミッドLucas-Kanade法で追跡し、全てのランドマークをアフィン変換で動かす.
+    追跡できた点が少ない・アフィン変換で近似できない場合は、次のキーフレームを待たずに推論する.
+    キーフレームの間隔は、顔が速く動くと短く、止まっていると長くなる.
+    """
+
+    NUM_TRACK_POINTS: Final = 64  # 追跡するランドマークの数
+    MIN_TRACKED_RATIO: Final = 0.7  # 追跡できた点の割合がこれ未満なら推論する
+    MAX_FIT_ERROR: Final = 2.0  # アフィン変換で近似したときの誤差(px, 中央値)がこれ以上なら推論する
+    MAX_FORWARD_BACKWARD_ERROR: Final = 1.0  # 前向き・後ろ向きに追跡した位置のずれ(px)がこれ以上の点は使わない
+    FAST_MOTION: Final = 8.0  # 1フレームの移動量(px)がこれより大きいと、キーフレームの間隔を半分にする
+    SLOW_MOTION: Final = 2.0  # 1フレームの移動量(px)がこれより小さいと、キーフレームの間隔を1つ伸ばす
+    LK_PARAMS: Final = dict(
+        winSize=(21, 21),
+        maxLevel=3,
+        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+    )
+
+    def __init__(self, face_mesh: FaceMesh, max_interval: int, min_interval: int = 1):
+        """Initialize LandmarkTracker.
+
+        Args:
+            face_mesh (FaceMesh): face mesh used on keyframes
+            max_interval (int): maximum keyframe interval in frames. (keyframe every this many frames)
+            min_interval (int, optional): minimum keyframe interval in frames. Defaults to 1. (1 means every frame)
+        """
+        self.face_mesh = face_mesh
+        self.max_interval = max_interval
+        self.min_interval = min(min_interval, max_interval)
+        self.interval = max_interval
+        self.keyframe_count = 0
+        self.tracked_count = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Discard the tracked landmarks. (次のフレームで推論する)"""
+        self.prev_gray: np.ndarray | None = None
+        self.prev_landmarks: np.ndarray | None = None
+        self.track_indices: np.ndarray | None = None  # 追跡するランドマークのindex
+        self.frames_since_keyframe = 0
+
+    def get_landmarks(self, image: np.ndarray) -> np.ndarray:
+        """Get landmarks. (FaceMesh.get_landmarksと同じように使える)
+
+        Args:
+            image (np.ndarray): image(BGR)
+
+        Returns:
+            np.ndarray: landmarks
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        landmarks = None
+        # キーフレームもintervalに数える (interval=1なら毎フレーム推論する)
+        if self.frames_since_keyframe < self.interval - 1:
+            landmarks = self._track(gray)
+
+        if landmarks is None:
+            try:
+                landmarks = self.face_mesh.get_landmarks(image)
+            except Exception as e:
+                self.reset()
+                raise e
+            self._set_keyframe(gray, landmarks)
+            self.keyframe_count += 1
+        else:
+            self.frames_since_keyframe += 1
+            self.tracked_count += 1
+
+        self.prev_gray = gray
+        self.prev_landmarks = landmarks
+        return landmarks
+
+    def _set_keyframe(self, gray: np.ndarray, landmarks: np.ndarray) -> None:
+        """推論したランドマークから、追跡するランドマーク(コーナーらしさが大きい点)を選ぶ.
+
+        Args:
+            gray (np.ndarray): grayscale image
+            landmarks (np.ndarray): inferred landmarks
+        """
+        min_eigen_values = cv2.cornerMinEigenVal(gray, blockSize=5)
+        xs = np.clip(landmarks[:, 0].astype(np.int32), 0, gray.shape[1] - 1)
+        ys = np.clip(landmarks[:, 1].astype(np.int32), 0, gray.shape[0] - 1)
+        self.track_indices = np.argsort(min_eigen_values[ys, xs])[::-1][: self.NUM_TRACK_POINTS]
+        self.frames_since_keyframe = 0
+
+    def _track(self, gray: np.ndarray) -> np.ndarray | None:
+        """前のフレームからランドマークを追跡する.
+
+        Args:
+            gray (np.ndarray): grayscale image
+
+        Returns:
+            np.ndarray | None: tracked landmarks. None if tracking failed.
+        """
+        if (
+            self.prev_gray is None
+            or self.prev_landmarks is None
+            or self.track_indices is None
+            or self.prev_gray.shape != gray.shape
+        ):
+            return None
+
+        prev_points = self.prev_landmarks[self.track_indices, :2].astype(np.float32).reshape(-1, 1, 2)
+        points, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, prev_points, None, **self.LK_PARAMS)
+        back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, points, None, **self.LK_PARAMS)
+        forward_backward_error = np.linalg.norm(back_points - prev_points, axis=2).ravel()
+        good = (status.ravel() == 1) & (back_status.ravel() == 1)
+        good &= forward_backward_error < self.MAX_FORWARD_BACKWARD_ERROR
+        if good.sum() < self.MIN_TRACKED_RATIO * len(prev_points):
+            return None
+
+        src, dst = prev_points[good].reshape(-1, 2), points[good].reshape(-1, 2)
+        warp_mat, _ = cv2.estimateAffine2D(src, dst, method=cv2.RANSAC, ransacReprojThreshold=self.MAX_FIT_ERROR)
+        if warp_mat is None:
+            return None
+        fit_error = np.median(np.linalg.norm(src @ warp_mat[:, :2].T + warp_mat[:, 2] - dst, axis=1))
+        if fit_error >= self.MAX_FIT_ERROR:
+            return None
+
+        self._update_interval(float(np.median(np.linalg.norm(dst - src, axis=1))))
+
+        landmarks = self.prev_landmarks.copy()
+        landmarks[:, :2] = self.prev_landmarks[:, :2] @ warp_mat[:, :2].T + warp_mat[:, 2]
+        landmarks[:, 2] *= np.sqrt(abs(np.linalg.det(warp_mat[:, :2])))  # zも拡大・縮小に合わせる
+        return landmarks
+
+    def _update_interval(self, motion: float) -> None:
+        """顔の動きの大きさからキーフレームの間隔を変える.
+
+        Args:
+            motion (float): 1フレームの移動量(px)
+        """
+        if motion > self.FAST_MOTION:
+            self.interval = max(self.min_interval, self.interval // 2)
+        elif motion < self.SLOW_MOTION:
+            self.interval = min(self.max_interval, self.interval + 1)
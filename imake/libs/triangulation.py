@@ -0,0 +1,197 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Final
+
+import cv2
+import numpy as np
+
+CACHE_DIR_PATH: Final = "imake/res/cache"  # 三角形分割の結果を保存するディレクトリ
+CACHE_FILE_PREFIX: Final = "triangles-"
+
+# プロセス全体で共有するキャッシュ. 配列は書き換えられないようにread-onlyにしておく
+_points_cache: dict[str, np.ndarray] = {}
+_triangles_cache: dict[str, np.ndarray] = {}
+_mesh_cache: dict[str, "Mesh"] = {}
+
+NO_TRIANGLE_ID: Final = -1  # 三角形IDマップで、どの三角形にも含まれない画素の値
+
+
+def load_points(path: str) -> np.ndarray:
+    """npyファイルを読み込む (プロセス内で一度だけ読み込む).
+
+    Args:
+        path (str): npy file path
+
+    Returns:
+        np.ndarray: read-only array
+    """
+    if path not in _points_cache:
+        points = np.load(path)
+        points.setflags(write=False)
+        _points_cache[path] = points
+    return _points_cache[path]
+
+
+def get_triangles(src_points: np.ndarray, point_indices: np.ndarray | None, width: int, height: int) -> np.ndarray:
+    """src_points[point_indices]のドロネー三角形分割を取得する.
+
+    結果は(src_points, point_indices)の内容のハッシュをキーにして、プロセス内とCACHE_DIR_PATHに保存される.
+
+    Args:
+        src_points (np.ndarray): all source landmarks (N x 2)
+        point_indices (np.ndarray | None): indices of the landmarks to triangulate. (If None, use all landmarks)
+        width (int): width of the source image
+        height (int): height of the source image
+
+    Returns:
+        np.ndarray: triangles (T x 3). Each value is an index of src_points[point_indices]. (read-only)
+    """
+    key = _get_cache_key(src_points, point_indices, width, height)
+    if key in _triangles_cache:
+        return _triangles_cache[key]
+
+    cache_path = os.path.join(CACHE_DIR_PATH, f"{CACHE_FILE_PREFIX}{key}.npy")
+    try:
+        triangles = np.load(cache_path)
+    except (OSError, ValueError):
+        points = src_points if point_indices is None else src_points[point_indices]
+        triangles = _triangulate(points, width, height)
+        _save(cache_path, triangles)
+
+    triangles.setflags(write=False)
+    _triangles_cache[key] = triangles
+    return triangles
+
+
+@dataclass(frozen=True)
+class Mesh:
+    """Triangulation of the source landmarks."""
+
+    triangles: np.ndarray  # 三角形 (T x 3). 値は全てのランドマーク(src_points)のindex
+    triangle_id_map: np.ndarray  # 各画素を含む三角形のindex (height x width). どの三角形にも含まれない画素はNO_TRIANGLE_ID
+
+
+def get_mesh(src_points: np.ndarray, point_indices: np.ndarray | None, width: int, height: int) -> Mesh:
+    """src_points[point_indices]を三角形分割したMeshを取得する (プロセス内にキャッシュされる).
+
+    Args:
+        src_points (np.ndarray): all source landmarks (N x 2)
+        point_indices (np.ndarray | None): indices of the landmarks to triangulate. (If None, use all landmarks)
+        width (int): width of the source image
+        height (int): height of the source image
+
+    Returns:
+        Mesh: mesh (arrays are read-only)
+    """
+    key = _get_cache_key(src_points, point_indices, width, height)
+    if key not in _mesh_cache:
+        triangles = get_triangles(src_points, point_indices, width, height)
+        if point_indices is not None:
+            triangles = point_indices[triangles]
+        triangles.setflags(write=False)
+        triangle_id_map = rasterize_triangles(src_points[triangles].astype(np.int32), width, height)
+        triangle_id_map.setflags(write=False)
+        _mesh_cache[key] = Mesh(triangles=triangles, triangle_id_map=triangle_id_map)
+    return _mesh_cache[key]
+
+
+def select_coarse_points(src_points: np.ndarray, point_indices: np.ndarray, num_points: int) -> np.ndarray:
+    """最遠点サンプリングでpoint_indicesからnum_points個のランドマークを選ぶ.
+
+    Args:
+        src_points (np.ndarray): all source landmarks (N x 2)
+        point_indices (np.ndarray): indices of the candidate landmarks
+        num_points (int): number of landmarks to select
+
+    Returns:
+        np.ndarray: selected indices (sorted)
+    """
+    points = src_points[point_indices].astype(np.float64)
+    selected = [0]
+    distances = np.linalg.norm(points - points[0], axis=1)
+    for _ in range(min(num_points, len(points)) - 1):
+        idx = int(np.argmax(distances))
+        selected.append(idx)
+        distances = np.minimum(distances, np.linalg.norm(points - points[idx], axis=1))
+    return np.sort(point_indices[selected])
+
+
+def rasterize_triangles(triangles: np.ndarray, width: int, height: int) -> np.ndarray:
+    """三角形IDマップを描画する. 重なった画素は先の三角形を優先する.
+
+    Args:
+        triangles (np.ndarray): triangle coordinates (T x 3 x 2, int32)
+        width (int): width of the map
+        height (int): height of the map
+
+    Returns:
+        np.ndarray: triangle id map (height x width, int32)
+    """
+    triangle_id_map = np.full((height, width), NO_TRIANGLE_ID, np.int32)
+    for idx in range(len(triangles) - 1, -1, -1):  # 先の三角形を優先するため、後ろから順に塗りつぶす
+        cv2.fillConvexPoly(triangle_id_map, triangles[idx], idx)
+    return triangle_id_map
+
+
+def _get_cache_key(src_points: np.ndarray, point_indices: np.ndarray | None, width: int, height: int) -> str:
+    """Get cache key from the contents of the arrays.
+
+    Args:
+        src_points (np.ndarray): all source landmarks
+        point_indices (np.ndarray | None): indices of the landmarks to triangulate
+        width (int): width of the source image
+        height (int): height of the source image
+
+    Returns:
+        str: cache key
+    """
+    sha1 = hashlib.sha1()
+    for array in (src_points, point_indices):
+        if array is not None:
+            array = np.ascontiguousarray(array)
+            sha1.update(f"{array.dtype.str}{array.shape}".encode())
+            sha1.update(array.tobytes())
+        sha1.update(b"|")
+    sha1.update(f"{width}x{height}".encode())
+    return sha1.hexdigest()
+
+
+def _triangulate(points: np.ndarray, width: int, height: int) -> np.ndarray:
+    """ドロネー三角形分割を行い、頂点をpointsのindexで表した三角形を返す.
+
+    Args:
+        points (np.ndarray): points (N x 2)
+        width (int): width of the source image
+        height (int): height of the source image
+
+    Returns:
+        np.ndarray: triangles (T x 3)
+    """
+    subdiv = cv2.Subdiv2D((0, 0, width, height))  # cv2.Subdiv2D((left, top, right, bottom))
+    subdiv.insert(points.tolist())  # 対象の点を追加
+
+    index_of = {(float(x), float(y)): idx for idx, (x, y) in enumerate(points)}
+    # ドロネー三角形を取得 element=[1個目のx座標 1個目のy座標 2個目のx座標 2個目のy座標 3個目のx座標 3個目のy座標]
+    return np.array(
+        [[index_of[(float(x), float(y))] for x, y in element.reshape((3, 2))] for element in subdiv.getTriangleList()],
+        dtype=np.int64,
+    ).reshape(-1, 3)
+
+
+def _save(path: str, triangles: np.ndarray) -> None:
+    """Save triangles to the cache file. (書き込めない環境では保存しない)
+
+    Args:
+        path (str): cache file path
+        triangles (np.ndarray): triangles
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            np.save(f, triangles)
+        os.replace(tmp_path, path)  # 他のプロセスが書き込み途中のファイルを読まないようにする
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -1,15 +1,16 @@
 import os
 from dataclasses import asdict
-from typing import Any, Final
+from typing import Any, Final, Hashable
 
-import cv2
 import numpy as np
 import yaml
 from PIL import Image
 
 from ..dataclasses import HSV, FacePaint
 from ..libs.effect import Effect
+from ..libs.imagecache import effect_cache, get_asset_key, read_image
 from ..libs.list import get_index
+from ..libs.recolor import get_recolorer
 
 
 class BaseMode:
@@ -88,9 +89,18 @@ class BaseModeEffect(BaseMode, Effect):
         if self.skin_image is None:
             raise ValueError("skin_image is None")
 
+        # 同じ素材・色の組み合わせは、合成し直さずにキャッシュを使う
+        facepaint_keys = tuple(self._get_facepaint_key(facepaint) for facepaint in facepaints)
+        key = ("effect", self.skin_key, facepaint_keys)
+        cached_image = effect_cache.get(key)
+        if cached_image is not None:
+            return cached_image
+
         effect_image = self.skin_image
-        for facepaint in facepaints:
-            image = cv2.imread(facepaint.image_path, cv2.IMREAD_UNCHANGED)
+        for i, facepaint in enumerate(facepaints):
+            image_key, base_image_key, _ = facepaint_keys[i]
+            recolor_key: Hashable = image_key
+            image = read_image(facepaint.image_path)
             if image is None:
                 raise Exception(f"Failed to read image: {facepaint.image_path}")
             if not (image.shape[0] == Effect.EFFECT_IMAGE_HEIGHT and image.shape[1] == Effect.EFFECT_IMAGE_WIDTH):
@@ -100,7 +110,7 @@ class BaseModeEffect(BaseMode, Effect):
                 ".png", self.BASE_IMAGE_SUFFIX
             )  # ２枚重ねによって作られるメイク画像の色変更をしない方の画像名
             if os.path.exists(base_image_path):
-                base_image = cv2.imread(base_image_path, cv2.IMREAD_UNCHANGED)
+                base_image = read_image(base_image_path)
                 if base_image is None:
                     raise Exception(f"Failed to read image: {base_image_path}")
                 if not (
@@ -109,10 +119,36 @@ class BaseModeEffect(BaseMode, Effect):
                 ):
                     raise ValueError("Base image size must be 1024x1024")
                 image = self._overlay_alpha_image(effect_image, base_image)
+                # 色を変える画像は、ここまでに合成した画像と色変更をしない方の画像で決まる
+                recolor_key = (("effect", self.skin_key, facepaint_keys[:i]), base_image_key)
 
-            image = self._convert_image_color(image, facepaint.hsv, True) if facepaint.hsv is not None else image
+            image = (
+                self._convert_image_color(image, facepaint.hsv, True, recolor_key)
+                if facepaint.hsv is not None
+                else image
+            )
             effect_image = self._overlay_alpha_image(effect_image, image)
-        return effect_image
+        return effect_cache.put(key, effect_image)
+
+    def _get_facepaint_key(self, facepaint: FacePaint) -> Hashable:
+        """合成したエフェクト画像のキャッシュのキーのうち、1つのメイクの分を作る.
+
+        Args:
+            facepaint (FacePaint): FacePaint
+        Returns:
+            Hashable: (素材画像, ２枚重ねの色変更をしない方の画像, HSV). 画像はパスと更新時刻で表す
+        """
+        base_image_path = facepaint.image_path.replace(".png", self.BASE_IMAGE_SUFFIX)
+        return (
+            get_asset_key(facepaint.image_path),
+            get_asset_key(base_image_path),
+            self._get_hsv_key(facepaint.hsv),
+        )
+
+    @staticmethod
+    def _get_hsv_key(hsv: HSV | None) -> tuple[float, float, float] | None:
+        """HSVをキャッシュのキーにできる形にする. (HSVはhashableではない)"""
+        return None if hsv is None else (hsv.h, hsv.s, hsv.v)
 
     def _overlay_alpha_image(self, back: np.ndarray, front: np.ndarray) -> np.ndarray:
         """Overlay alpha image on the background image.
@@ -137,68 +173,48 @@ class BaseModeEffect(BaseMode, Effect):
             hsv (HSV): HSV
             set_as_effect_image (bool, optional): スキンカラーをセットした画像をエフェクト画像としてセットするかどうか. Defaults to False.
         """
-        base_skin_image = cv2.imread(self.SKIN_IMAGE_PATH, cv2.IMREAD_UNCHANGED)
-        if base_skin_image is None:
-            raise Exception(f"Failed to read image: {self.SKIN_IMAGE_PATH}")
-        if not (
-            base_skin_image.shape[0] == Effect.EFFECT_IMAGE_HEIGHT
-            and base_skin_image.shape[1] == Effect.EFFECT_IMAGE_WIDTH
-        ):
-            raise ValueError("Skin image size must be 1024x1024")
-
-        self.skin_image = self._convert_image_color(base_skin_image, hsv, True)
+        self.skin_key = ("skin", get_asset_key(self.SKIN_IMAGE_PATH), self._get_hsv_key(hsv))
+        skin_image = effect_cache.get(self.skin_key)
+        if skin_image is None:
+            base_skin_image = read_image(self.SKIN_IMAGE_PATH)
+            if base_skin_image is None:
+                raise Exception(f"Failed to read image: {self.SKIN_IMAGE_PATH}")
+            if not (
+                base_skin_image.shape[0] == Effect.EFFECT_IMAGE_HEIGHT
+                and base_skin_image.shape[1] == Effect.EFFECT_IMAGE_WIDTH
+            ):
+                raise ValueError("Skin image size must be 1024x1024")
+            skin_image = effect_cache.put(
+                self.skin_key, self._convert_image_color(base_skin_image, hsv, True, self.skin_key[1])
+            )
+
+        self.skin_image = skin_image
         if set_as_effect_image:
             self.set_effect_image(self.skin_image)
 
-    def _convert_image_color(self, image: np.ndarray, hsv: HSV, include_alpha_ch: bool) -> np.ndarray:
+    def _convert_image_color(
+        self, image: np.ndarray, hsv: HSV, include_alpha_ch: bool, key: Hashable | None = None
+    ) -> np.ndarray:
         """アルファチャンネル付きのRGB=(0,0,255)の画像の色を、指定したHSV数値の色に変更する.
 
         Args:
             image (np.ndarray): RGB=(0,0,255)で塗りつぶしたアルファチャンネルを含むメイク素材、1024x1024
             hsv (HSV): HSV
             include_alpha_ch (bool): returnする画像にアルファチャンネルを含むか否か
+            key (Hashable | None, optional): imageの内容を表すキー. Defaults to None.
+                (指定すると前計算をキャッシュして、同じ素材の色の変更はLUTを引くだけになる)
         Return:
             np.ndarray: 任意の色、設定に変更したメイクのnumpy配列
         """
-        # opencvでのHSVの範囲は0-180,0-255,0-255
-        hue = hsv.h / 2
-        sat = hsv.s / 100 * 255
-        val = hsv.v / 100 * 255
-        image_wo_alpha, mask = self._convert_bgra_to_bgr(image)
-        image_hsv = cv2.cvtColor(image_wo_alpha, cv2.COLOR_BGR2HSV)
-
-        image_hue = image_hsv[:, :, 0]
-        image_sat = image_hsv[:, :, 1]
-        image_hsv[:, :, 0] = np.where(
-            (image_hue > self.B255_HUE - self.BUFF) & (image_hue < self.B255_HUE + self.BUFF), hue, image_hsv[:, :, 0]
-        )
-        image_hsv[:, :, 1] = np.where(
-            (image_sat > self.B255_SAT - self.BUFF) & (image_sat < self.B255_SAT + self.BUFF), sat, image_hsv[:, :, 1]
-        )
-        image_hsv[:, :, 2] = np.where(
-            image_hsv[:, :, 2] != self.NO_CHANGE_VAL, (val * (image_hsv[:, :, 2] / 255)), image_hsv[:, :, 2]
+        recolorer = get_recolorer(
+            key,
+            image,
+            (self.B255_HUE - self.BUFF, self.B255_HUE + self.BUFF),
+            (self.B255_SAT - self.BUFF, self.B255_SAT + self.BUFF),
+            self.NO_CHANGE_VAL,
         )
-        # ↑グラデーションの比率を保ったまま、明度を変更する
-
-        image_bgr = cv2.cvtColor(image_hsv, cv2.COLOR_HSV2BGR)
-
-        if include_alpha_ch:
-            b_ch, g_ch, r_ch = cv2.split(image_bgr[:, :, :3])
-            image_bgr_w_alpha = cv2.merge((b_ch, g_ch, r_ch, mask))
-            return image_bgr_w_alpha
-        else:
-            return image_bgr
-
-    def _convert_bgra_to_bgr(self, image: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
-        """Convert RGBA image to RGB image.
-
-        Args:
-            image (np.ndarray): RGBA image
-        Returns:
-            _type_: BGRとA
-        """
-        mask = image[:, :, 3]
-        return (image[:, :, :3] * np.dstack([mask / 255] * 3)).astype(np.uint8), mask
+        # opencvでのHSVの範囲は0-180,0-255,0-255
+        return recolorer.recolor(hsv.h / 2, hsv.s / 100 * 255, hsv.v / 100 * 255, include_alpha_ch)
 
     @classmethod
     def get_choice_facepaints(cls) -> list[dict]: